@@ -1,26 +1,82 @@
 """照明器具選定エージェント"""
+import asyncio
 import os
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 from app.models.chat import Message, ChatResponse, ProjectInfo
-from app.utils.search_categories import search_categories, search_categories_by_keywords, search_categories_by_text
+from app.utils.search_categories import (
+    enforce_manufacturer_quota,
+    search_categories,
+    search_categories_by_keywords,
+    search_categories_by_text,
+    search_categories_partitioned
+)
+from app.utils.recommendations import ceiling_band, get_precomputed_recommendations
+from app.utils.capture import CapturingChatModel
+from app.utils.http_client import get_http_client
+from app.utils.prefetch import get_retrieval_prefetcher
 import json
 
+
+# 相見積もりで各メーカーから確保する候補の最低件数
+COMPETITOR_MIN_PER_MANUFACTURER = int(os.getenv("COMPETITOR_MIN_PER_MANUFACTURER", "2"))
+
+
+def build_search_terms(project_info: ProjectInfo, user_message: str) -> Tuple[str, List[str]]:
+    """
+    物件情報から検索クエリとキーワードを生成する
+
+    Args:
+        project_info: 物件情報
+        user_message: ユーザーの最新メッセージ
+
+    Returns:
+        (自然言語クエリ, キーワードのリスト)
+    """
+    keywords = []
+    query_parts = []
+
+    if project_info.property_name:
+        query_parts.append(project_info.property_name)
+        keywords.append(project_info.property_name)
+
+    if project_info.room_name:
+        query_parts.append(project_info.room_name)
+        keywords.append(project_info.room_name)
+
+    band = ceiling_band(project_info.ceiling_height)
+    if band == "high":
+        keywords.append("高天井")
+        query_parts.append("高天井")
+    elif band == "low":
+        keywords.append("低天井")
+
+    if project_info.special_environment:
+        keywords.append("特殊環境")
+        query_parts.append("特殊環境")
+        if "クリーン" in user_message or "無塵" in user_message:
+            keywords.append("クリーンルーム")
+        if "厨房" in user_message or "HACCP" in user_message:
+            keywords.append("厨房")
+
+    # 自然言語クエリを生成
+    query = f"{' '.join(query_parts)}に適した照明器具"
+    return query, keywords
+
+
 class LightingAgent:
     """照明器具選定を支援するエージェント"""
     
     def __init__(self):
         """エージェントの初期化"""
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
+        self.api_key = os.getenv("OPENAI_API_KEY")
+        if not self.api_key:
             raise ValueError("OPENAI_API_KEYが設定されていません")
         
-        self.llm = ChatOpenAI(
-            model="gpt-4-turbo-preview",
-            temperature=0.7,
-            api_key=api_key
-        )
+        # LLMは最初の呼び出し時に作成する（共有のHTTPクライアントは起動処理で作成されるため）
+        self._llm: Optional[CapturingChatModel] = None
+        self._http_client = None
 
         # システムプロンプト
         self.system_prompt = """あなたは照明器具の選定を支援する専門家です。
@@ -38,6 +94,24 @@ class LightingAgent:
                             思考プロセスは明確に表示し、ユーザーが理解しやすいように説明してください。
                             """
 
+    @property
+    def llm(self) -> CapturingChatModel:
+        """チャット用のLLMを取得（共有のHTTPクライアントが作り直された場合はLLMも作り直す）"""
+        http_client = get_http_client()
+        if self._llm is None or self._http_client is not http_client:
+            # キャプチャ・リプレイ時は上流の応答を記録・再生する
+            self._llm = CapturingChatModel(ChatOpenAI(
+                model="gpt-4-turbo-preview",
+                temperature=0.7,
+                api_key=self.api_key,
+                # Embedding用のクライアントと接続プールを共有する
+                http_async_client=http_client,
+                # 未指定だとリクエストごとに timeout=None が渡され、共有クライアントのタイムアウトが効かない
+                timeout=http_client.timeout
+            ))
+            self._http_client = http_client
+        return self._llm
+
     async def process_message(
         self,
         messages: List[Message],
@@ -82,12 +156,22 @@ class LightingAgent:
                 langchain_messages
             )
         else:
+            # 部屋名などが分かっていれば、ユーザーの入力を待つ間に検索を先読みする
+            if project_info:
+                self._start_prefetch(project_info)
             # 物件情報が不足している場合は質問を生成
             return await self._generate_question_response(
                 latest_message,
                 langchain_messages
             )
     
+    def _start_prefetch(self, project_info: ProjectInfo) -> None:
+        """途中まで入力された物件情報でEmbedding検索を先読みする"""
+        # 物件名は先読みの時点では未入力のため、クエリにも含めない
+        partial_info = project_info.model_copy(update={"property_name": None})
+        query, _ = build_search_terms(partial_info, "")
+        get_retrieval_prefetcher().start(project_info, query)
+
     async def _generate_question_response(
         self,
         user_message: str,
@@ -132,42 +216,104 @@ class LightingAgent:
         # 思考プロセスを生成
         thinking = await self._generate_thinking(project_info, user_message)
 
-        # 物件情報から検索キーワードを生成
-        keywords = []
-        query_parts = []
-
-        if project_info.property_name:
-            query_parts.append(project_info.property_name)
-            keywords.append(project_info.property_name)
+        # 物件情報から検索クエリとキーワードを生成
+        query, keywords = build_search_terms(project_info, user_message)
 
-        if project_info.room_name:
-            query_parts.append(project_info.room_name)
-            keywords.append(project_info.room_name)
+        # 相見積もりでは各メーカーの候補を最低件数ずつ確保する
+        min_per_manufacturer = (
+            COMPETITOR_MIN_PER_MANUFACTURER if project_info.project_type == "相見積もり" else 0
+        )
+        partitioned = bool(project_info.manufacturers) or min_per_manufacturer > 0
 
-        if project_info.ceiling_height:
-            if project_info.ceiling_height > 8:
-                keywords.append("高天井")
-                query_parts.append("高天井")
-            else:
-                keywords.append("低天井")
-        
-        if project_info.special_environment:
-            keywords.append("特殊環境")
-            query_parts.append("特殊環境")
-            if "クリーン" in user_message or "無塵" in user_message:
-                keywords.append("クリーンルーム")
-            if "厨房" in user_message or "HACCP" in user_message:
-                keywords.append("厨房")
+        # 事前計算済みの推薦があればライブ検索を省略（メーカー指定・相見積もりは対象外）
+        search_method = "llm_text_search"
+        rerank_usage: Dict[str, Any] = {}
+        # （テーブルの再読み込み・候補の取得はDBを同期的に呼ぶため別スレッドで行う）
+        candidates = (
+            None if partitioned
+            else await asyncio.to_thread(get_precomputed_recommendations().lookup, project_info)
+        )
+        if candidates:
+            search_method = "precomputed"
+        else:
+            # 質問フェーズ中に先読みした検索結果があれば再利用する
+            prefetched = None if partitioned else await get_retrieval_prefetcher().take(project_info)
+            candidates = await self.retrieve_candidates(
+                query,
+                keywords,
+                manufacturers=project_info.manufacturers,
+                min_per_manufacturer=min_per_manufacturer,
+                embedding_candidates=prefetched,
+                rerank_usage=rerank_usage
+            )
+            if partitioned:
+                search_method = "partitioned_search"
+            elif prefetched:
+                search_method = "prefetched"
         
-        # 自然言語クエリを生成
-        query = f"{' '.join(query_parts)}に適した照明器具"
+        # 応答を生成
+        response_message = await self._generate_candidates_response(
+            project_info,
+            candidates,
+            user_message,
+            langchain_messages
+        )
         
-        # ステップ1: Embedding類似度検索で上位20件を取得（高速）
-        embedding_candidates = await search_categories(
-            query=query,
-            use_embedding=True,
-            use_llm=False
+        metadata = {
+            "project_info": project_info.model_dump(),
+            "search_count": len(candidates),
+            "search_method": search_method
+        }
+        if rerank_usage:
+            # 再ランキングの方式とトークン数
+            metadata["rerank"] = rerank_usage
+
+        return ChatResponse(
+            message=response_message,
+            thinking=thinking,
+            search_queries=[query] + keywords,
+            candidates=candidates[:10],  # 最大10件
+            metadata=metadata
         )
+    
+    async def retrieve_candidates(
+        self,
+        query: str,
+        keywords: List[str],
+        manufacturers: Optional[List[str]] = None,
+        min_per_manufacturer: int = 0,
+        embedding_candidates: Optional[List[Dict[str, Any]]] = None,
+        rerank_usage: Optional[Dict[str, Any]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Embedding検索とLLM再ランキングで候補機種を取得する
+
+        Args:
+            query: 自然言語クエリ
+            keywords: キーワード検索・補完に使うキーワード
+            manufacturers: 対象メーカー（Noneの場合は全メーカー）
+            min_per_manufacturer: 各メーカーから確保する最低件数
+            embedding_candidates: 先読み済みのEmbedding検索結果（指定時はステップ1を省略）
+            rerank_usage: 指定した場合、再ランキングの方式とトークン数を書き込む
+
+        Returns:
+            候補機種のリスト（重要度順）
+        """
+        # ステップ1: Embedding類似度検索で上位20件を取得（高速、先読み済みなら省略）
+        if not embedding_candidates:
+            if manufacturers or min_per_manufacturer > 0:
+                # メーカー別に並行して検索し、マージする
+                embedding_candidates = await search_categories_partitioned(
+                    query=query,
+                    manufacturers=manufacturers,
+                    min_per_manufacturer=min_per_manufacturer
+                )
+            else:
+                embedding_candidates = await search_categories(
+                    query=query,
+                    use_embedding=True,
+                    use_llm=False
+                )
         
         # ステップ2: 上位20件のみをLLMに渡して再ランキング/詳細判定（低コスト）
         if embedding_candidates and len(embedding_candidates) > 0:
@@ -176,7 +322,15 @@ class LightingAgent:
                 query=query,
                 categories=embedding_candidates,
                 llm=self.llm,
-                max_results=10
+                max_results=10,
+                usage=rerank_usage
+            )
+            # 再ランキングで外れたメーカーの候補を補う
+            candidates = enforce_manufacturer_quota(
+                candidates,
+                embedding_candidates,
+                min_per_manufacturer=min_per_manufacturer,
+                limit=10
             )
         else:
             # Embedding検索が失敗した場合は従来の方法にフォールバック
@@ -198,27 +352,12 @@ class LightingAgent:
                     candidates.append(candidate)
                 if len(candidates) >= 5:
                     break
-        
-        # 応答を生成
-        response_message = await self._generate_candidates_response(
-            project_info,
-            candidates,
-            user_message,
-            langchain_messages
-        )
-        
-        return ChatResponse(
-            message=response_message,
-            thinking=thinking,
-            search_queries=[query] + keywords,
-            candidates=candidates[:10],  # 最大10件
-            metadata={
-                "project_info": project_info.model_dump(),
-                "search_count": len(candidates),
-                "search_method": "llm_text_search"
-            }
-        )
-    
+
+        if manufacturers:
+            candidates = [c for c in candidates if c.get('manufacturer') in manufacturers]
+
+        return candidates
+
     async def _generate_thinking(
         self,
         project_info: ProjectInfo,
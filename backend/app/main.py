@@ -1,12 +1,39 @@
 """FastAPIアプリケーションのエントリーポイント"""
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.routes import chat
+from app.routes import categories, chat, metrics
+from app.utils.catalog_changes import get_catalog_change_feed
+from app.utils.category_cache import get_category_cache
+from app.utils.http_client import close_http_client, get_http_client, warm_up_http_client
+from app.utils.keyword_index import get_keyword_index
+from app.utils.prefetch import get_retrieval_prefetcher
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """起動・終了時の処理"""
+    # カタログ変更フィードのポーリングを開始（カテゴリキャッシュは変更のあったIDだけ破棄する）
+    catalog_feed = get_catalog_change_feed()
+    get_category_cache()
+    get_retrieval_prefetcher()
+    await catalog_feed.start()
+    # キーワード検索用の転置インデックスを構築（以降の変更はフィードで差分反映）
+    await get_keyword_index().load()
+    # 共有のHTTPクライアントを作成し、OpenAI APIへの接続を事前に確立（最初のリクエストでTLSハンドシェイクを待たない）
+    # （LLM・Embeddingのクライアントは最初の呼び出し時にこのクライアントを取得する）
+    get_http_client()
+    await warm_up_http_client()
+    yield
+    await catalog_feed.stop()
+    await close_http_client()
+
 
 app = FastAPI(
     title="OfficeLightNavi API",
     description="施設照明器具選定支援エージェントAPI",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS設定
@@ -30,6 +57,8 @@ app.add_middleware(
 
 # ルーター登録
 app.include_router(chat.router, prefix="/api", tags=["chat"])
+app.include_router(categories.router, prefix="/api", tags=["categories"])
+app.include_router(metrics.router, prefix="/api", tags=["metrics"])
 
 
 @app.get("/")
@@ -13,6 +13,7 @@ class ChatRequest(BaseModel):
     """チャットリクエストモデル"""
     messages: List[Message]
     context: Optional[dict] = None  # 物件情報などのコンテキスト
+    candidate_format: Literal["full", "ids"] = "full"  # ids: 候補をID・スコア・順位のみで返す（詳細は /api/categories で取得）
 
 
 class ChatResponse(BaseModel):
@@ -24,6 +25,13 @@ class ChatResponse(BaseModel):
     metadata: Optional[dict] = None
 
 
+class CandidateRef(BaseModel):
+    """ID参照形式の候補モデル"""
+    id: int
+    score: Optional[float] = None  # 類似度（取得できた場合）
+    rank: int  # 1始まりの順位
+
+
 class ProjectInfo(BaseModel):
     """物件情報モデル"""
     property_name: Optional[str] = None  # 物件名
@@ -34,4 +42,5 @@ class ProjectInfo(BaseModel):
     special_environment: bool = False  # 特殊環境
     dimming: bool = False  # 調光
     color_temperature: bool = False  # 調色
+    manufacturers: Optional[List[str]] = None  # 対象メーカー（指定時はそのメーカーに限定して検索）
 
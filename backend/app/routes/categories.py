@@ -0,0 +1,94 @@
+"""製品カテゴリ関連のAPIルート
+
+チャット応答の候補をID参照形式（candidate_format="ids"）で受け取ったクライアントが、
+カテゴリの詳細を取得するためのエンドポイント。ETag と Cache-Control を付与するため、
+クライアントやCDNでキャッシュできる。
+"""
+import asyncio
+import hashlib
+import json
+import os
+from typing import Any, List
+
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response
+from app.utils.search_categories import get_categories_by_ids
+
+router = APIRouter()
+
+# カテゴリ応答のキャッシュ期間（秒）
+CATEGORY_CACHE_MAX_AGE = int(os.getenv("CATEGORY_CACHE_MAX_AGE", "300"))
+# バッチ取得で指定できるIDの上限
+MAX_BATCH_IDS = 100
+
+
+def _etag(payload: Any) -> str:
+    """応答内容からETagを計算"""
+    body = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return '"' + hashlib.sha256(body.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def _cacheable_response(request: Request, payload: Any) -> Response:
+    """ETag / Cache-Control を付与し、If-None-Match が一致すれば304を返す"""
+    etag = _etag(payload)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={CATEGORY_CACHE_MAX_AGE}",
+    }
+    if_none_match = request.headers.get("if-none-match", "")
+    client_etags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    if etag in client_etags or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=payload, headers=headers)
+
+
+def _parse_ids(ids: str) -> List[int]:
+    try:
+        parsed = [int(part) for part in ids.split(",") if part.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids はカンマ区切りの整数で指定してください")
+    if not parsed:
+        raise HTTPException(status_code=400, detail="ids を指定してください")
+    if len(parsed) > MAX_BATCH_IDS:
+        raise HTTPException(status_code=400, detail=f"ids は最大{MAX_BATCH_IDS}件までです")
+    # 重複を除去し、順序を保持
+    return list(dict.fromkeys(parsed))
+
+
+@router.get("/categories")
+async def get_categories(
+    request: Request,
+    ids: str = Query(..., description="カンマ区切りのカテゴリID（例: 1,5,12）")
+):
+    """
+    カテゴリのバッチ取得エンドポイント
+
+    指定したIDの順にカテゴリを返す（存在しないIDは含まれない）
+    """
+    category_ids = _parse_ids(ids)
+    try:
+        # キャッシュにない場合はDBを同期的に呼ぶため、イベントループを止めないよう別スレッドで取得する
+        categories = await asyncio.to_thread(get_categories_by_ids, category_ids)
+        categories_by_id = {category["id"]: category for category in categories}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"エラーが発生しました: {str(e)}")
+
+    payload = {
+        "categories": [categories_by_id[category_id] for category_id in category_ids if category_id in categories_by_id]
+    }
+    return _cacheable_response(request, payload)
+
+
+@router.get("/categories/{category_id}")
+async def get_category(request: Request, category_id: int):
+    """
+    カテゴリ取得エンドポイント
+    """
+    try:
+        categories = await asyncio.to_thread(get_categories_by_ids, [category_id])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"エラーが発生しました: {str(e)}")
+
+    if not categories:
+        raise HTTPException(status_code=404, detail="カテゴリが見つかりません")
+    return _cacheable_response(request, categories[0])
@@ -1,7 +1,10 @@
 """チャット関連のAPIルート"""
 from fastapi import APIRouter, HTTPException
-from app.models.chat import ChatRequest, ChatResponse, Message
+from app.models.chat import CandidateRef, ChatRequest, ChatResponse, Message
 from app.agents.lighting_agent import LightingAgent
+from app.utils.admission import AdmissionRejected, get_admission_controller
+from app.utils.capture import capture_request
+from app.utils.response_cache import get_response_cache, make_cache_key
 import os
 from dotenv import load_dotenv
 
@@ -9,6 +12,8 @@ load_dotenv()
 
 router = APIRouter()
 agent = LightingAgent()
+admission = get_admission_controller()
+response_cache = get_response_cache()
 
 
 @router.post("/chat", response_model=ChatResponse)
@@ -26,13 +31,44 @@ async def chat(request: ChatRequest):
                 detail="OPENAI_API_KEYが設定されていません。.envファイルを確認してください。"
             )
         
-        # エージェントにリクエストを渡す
-        response = await agent.process_message(
-            messages=request.messages,
-            context=request.context
-        )
+        # 同じ物件情報・会話の応答がキャッシュにあればエージェントを呼ばない（同時実行枠も使わない）
+        cache_key = make_cache_key(request.messages, request.context) if response_cache.enabled else None
+        response = response_cache.get(cache_key) if cache_key else None
+
+        if response is None:
+            catalog_generation = response_cache.feed.generation
+            # 同時実行数の上限内でエージェントにリクエストを渡す
+            async with admission.admit():
+                # CAPTURE_PATHが設定されている場合は入力と上流の応答を記録
+                async with capture_request(request.model_dump()):
+                    response = await agent.process_message(
+                        messages=request.messages,
+                        context=request.context
+                    )
+            if cache_key:
+                response_cache.put(cache_key, response, catalog_generation)
+
+        if request.candidate_format == "ids":
+            response = _with_candidate_refs(response)
         
         return response
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail=f"混雑しています。しばらくしてから再度お試しください: {e.reason}",
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"エラーが発生しました: {str(e)}")
 
+
+def _with_candidate_refs(response: ChatResponse) -> ChatResponse:
+    """候補をID・スコア・順位のみの形式に置き換える"""
+    if not response.candidates:
+        return response
+
+    refs = [
+        CandidateRef(id=candidate["id"], score=candidate.get("similarity"), rank=rank).model_dump()
+        for rank, candidate in enumerate(response.candidates, start=1)
+    ]
+    return response.model_copy(update={"candidates": refs})
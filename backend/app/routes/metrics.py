@@ -0,0 +1,27 @@
+"""メトリクス関連のAPIルート"""
+from fastapi import APIRouter
+from app.utils.admission import get_admission_controller
+from app.utils.catalog_changes import get_catalog_change_feed
+from app.utils.category_cache import get_category_cache
+from app.utils.keyword_index import get_keyword_index
+from app.utils.prefetch import get_retrieval_prefetcher
+from app.utils.response_cache import get_response_cache
+
+router = APIRouter()
+
+
+@router.get("/metrics")
+async def metrics():
+    """
+    メトリクスエンドポイント
+
+    アドミッション制御の待ち行列の長さ・待ち時間、キャッシュのヒット数などを返す
+    """
+    return {
+        "admission": get_admission_controller().metrics(),
+        "catalog_feed": get_catalog_change_feed().metrics(),
+        "category_cache": get_category_cache().metrics(),
+        "prefetch": get_retrieval_prefetcher().metrics(),
+        "keyword_index": get_keyword_index().metrics(),
+        "response_cache": get_response_cache().metrics()
+    }
@@ -0,0 +1,193 @@
+"""チャットAPIのアドミッション制御（同時実行数の制限と待ち行列）
+
+バースト時に全リクエストが一斉に上流LLMを呼び出してレート制限に達するのを防ぐため、
+同時に実行するパイプライン数を制限し、超過分は上限付きの待ち行列で順番を待たせる。
+待ち行列が満杯、または待ち時間が上限を超えた場合は AdmissionRejected を送出する。
+"""
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+
+
+# 同時に実行するパイプライン数
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "4"))
+# 待ち行列の長さの上限
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+# 待ち行列での待ち時間の上限（秒）
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "15"))
+
+# 待ち時間の統計に使う直近のサンプル数
+WAIT_SAMPLE_SIZE = 1000
+# パイプライン所要時間の初期推定値（秒）
+INITIAL_DURATION_ESTIMATE = 5.0
+
+
+class AdmissionRejected(Exception):
+    """アドミッション制御によりリクエストが拒否された"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """同時実行数と待ち行列を管理する"""
+
+    def __init__(
+        self,
+        max_concurrency: int = ADMISSION_MAX_CONCURRENCY,
+        max_queue: int = ADMISSION_MAX_QUEUE,
+        queue_timeout: float = ADMISSION_QUEUE_TIMEOUT
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self._in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+        # メトリクス
+        self.admitted_total = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self._wait_samples: Deque[float] = deque(maxlen=WAIT_SAMPLE_SIZE)
+        self._wait_seconds_total = 0.0
+        self._duration_estimate = INITIAL_DURATION_ESTIMATE
+
+    @property
+    def in_flight(self) -> int:
+        """実行中のパイプライン数"""
+        return self._in_flight
+
+    @property
+    def queue_depth(self) -> int:
+        """待ち行列の長さ"""
+        return sum(1 for waiter in self._waiters if not waiter.done())
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        """
+        実行枠を確保してからブロック内の処理を実行する
+
+        Raises:
+            AdmissionRejected: 待ち行列が満杯、または待ち時間が上限を超えた場合
+        """
+        await self._acquire()
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._record_duration(time.monotonic() - started)
+            self._release()
+
+    async def _acquire(self) -> None:
+        if self._in_flight < self.max_concurrency and not self._waiters:
+            self._in_flight += 1
+            self._record_wait(0.0)
+            return
+
+        if self.queue_depth >= self.max_queue:
+            self.rejected_queue_full += 1
+            raise AdmissionRejected("待ち行列が満杯です", self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        enqueued = time.monotonic()
+        try:
+            await self._wait(waiter)
+        except asyncio.TimeoutError:
+            self._discard_waiter(waiter)
+            if not (waiter.done() and not waiter.cancelled()):
+                self.rejected_timeout += 1
+                raise AdmissionRejected("待ち時間が上限を超えました", self.retry_after())
+            # タイムアウトと同じタイミングで枠を譲り受けていた場合は、そのまま実行する
+        except BaseException:
+            # キャンセル直前に枠を譲り受けていた場合は返却する
+            self._discard_waiter(waiter)
+            if waiter.done() and not waiter.cancelled():
+                self._release()
+            raise
+
+        # 枠は _release から引き継がれている（_in_flight は増減しない）
+        self._record_wait(time.monotonic() - enqueued)
+
+    async def _wait(self, waiter: asyncio.Future) -> None:
+        """枠の引き渡しを待つ（上限を超えたら asyncio.TimeoutError）"""
+        await asyncio.wait_for(waiter, timeout=self.queue_timeout)
+
+    def _release(self) -> None:
+        # 待っているリクエストがあれば枠をそのまま引き渡す
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._in_flight -= 1
+
+    def _discard_waiter(self, waiter: asyncio.Future) -> None:
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def _record_wait(self, seconds: float) -> None:
+        self.admitted_total += 1
+        self._wait_seconds_total += seconds
+        self._wait_samples.append(seconds)
+
+    def _record_duration(self, seconds: float) -> None:
+        # 指数移動平均でパイプラインの所要時間を推定
+        self._duration_estimate = 0.8 * self._duration_estimate + 0.2 * seconds
+
+    def retry_after(self) -> int:
+        """待ち行列が捌けるまでの推定秒数（Retry-Afterヘッダー用）"""
+        pending = self.queue_depth + 1
+        estimate = self._duration_estimate * pending / max(self.max_concurrency, 1)
+        return max(1, min(60, math.ceil(estimate)))
+
+    def metrics(self) -> Dict[str, Any]:
+        """メトリクスを取得"""
+        samples = sorted(self._wait_samples)
+
+        def percentile(ratio: float) -> Optional[float]:
+            if not samples:
+                return None
+            index = min(len(samples) - 1, math.ceil(len(samples) * ratio) - 1)
+            return round(samples[max(index, 0)] * 1000, 1)
+
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "queue_timeout_seconds": self.queue_timeout,
+            "in_flight": self._in_flight,
+            "queue_depth": self.queue_depth,
+            "admitted_total": self.admitted_total,
+            "rejected_total": {
+                "queue_full": self.rejected_queue_full,
+                "timeout": self.rejected_timeout,
+            },
+            "wait_seconds_total": round(self._wait_seconds_total, 3),
+            "wait_ms": {
+                "p50": percentile(0.5),
+                "p95": percentile(0.95),
+                "max": percentile(1.0),
+            },
+            "pipeline_duration_estimate_seconds": round(self._duration_estimate, 3),
+        }
+
+
+# グローバルなコントローラーインスタンス
+_controller: Optional[AdmissionController] = None
+
+
+def get_admission_controller() -> AdmissionController:
+    """アドミッションコントローラーを取得（シングルトン）"""
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController()
+    return _controller
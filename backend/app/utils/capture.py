@@ -0,0 +1,330 @@
+"""リクエストのキャプチャと決定的なリプレイ
+
+CAPTURE_PATH を設定すると、/api/chat のリクエスト入力と、その処理中に発生した
+上流の応答（LLM・Embedding・DB）をJSONLファイルに1リクエスト1行で記録する（APIキーは伏せ字）。
+scripts/replay_requests.py は記録した応答を返すリプレイセッションで同じトラフィックを
+LightingAgent に流し直し、上流の遅延を任意に注入しながら自前のPythonオーバーヘッドを計測する。
+
+上流呼び出しは captured デコレーター（関数）と CapturingChatModel（LLM）で記録・再生される。
+セッションはcontextvarで伝搬するため、タスクやスレッドに分かれた呼び出しも同じリクエストに記録される。
+"""
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterator, List, Optional
+
+from pydantic import BaseModel
+
+
+# キャプチャの出力先（未設定の場合はキャプチャしない）
+CAPTURE_PATH = os.getenv("CAPTURE_PATH", "")
+
+REDACTED = "[REDACTED]"
+API_KEY_PATTERN = re.compile(r"sk-[A-Za-z0-9_\-]{10,}")
+
+_current_session: ContextVar[Optional["CaptureSession"]] = ContextVar("capture_session", default=None)
+# 記録中の呼び出しの内側では記録しない（外側の応答だけを再生すれば足りるため）
+_inside_capture: ContextVar[bool] = ContextVar("inside_capture", default=False)
+_write_lock = threading.Lock()
+
+
+class ReplayMismatchError(RuntimeError):
+    """リプレイ中に記録にない上流呼び出しが発生した"""
+
+
+class CaptureSession:
+    """1リクエスト分の上流呼び出しの記録（record）または再生（replay）"""
+
+    def __init__(
+        self,
+        mode: str = "record",
+        events: Optional[List[Dict[str, Any]]] = None,
+        latency: Optional[Dict[str, float]] = None,
+        fallback_by_kind: bool = False
+    ):
+        self.mode = mode
+        self.events: List[Dict[str, Any]] = events or []
+        self.latency = latency or {}  # 種別ごとの注入遅延（秒）、"*" は既定値
+        self.injected_seconds = 0.0
+        self.consumed = 0
+        # Trueの場合、キーが一致しない呼び出しに同じ種別の未使用の記録を返す（応答が別の呼び出しのものになりうる）
+        self.fallback_by_kind = fallback_by_kind
+        # 記録にない上流呼び出し（呼び出し側で例外が握りつぶされても検出できるよう残す）
+        self.mismatches: List[str] = []
+
+        self._by_key: Dict[tuple, Deque[Dict[str, Any]]] = defaultdict(deque)
+        self._by_kind: Dict[str, Deque[Dict[str, Any]]] = defaultdict(deque)
+        if mode == "replay":
+            for event in self.events:
+                self._by_key[(event["kind"], event["key"])].append(event)
+                self._by_kind[event["kind"]].append(event)
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def record(self, kind: str, key: str, response: Any, elapsed: float) -> None:
+        """上流の応答を記録"""
+        self.events.append({
+            "kind": kind,
+            "key": key,
+            "elapsed_ms": round(elapsed * 1000, 3),
+            "response": response,
+        })
+
+    def take(self, kind: str, key: str) -> Any:
+        """
+        記録した応答を取り出す
+
+        同じキーの記録を返す。fallback_by_kind が有効な場合のみ、
+        キーが一致しなければ同じ種別の未使用の記録を順番に返す。
+
+        Raises:
+            ReplayMismatchError: 対応する記録がない場合
+        """
+        queue = self._by_key.get((kind, key))
+        while queue:
+            event = queue.popleft()
+            if not event.get("_used"):
+                return self._use(event)
+
+        if self.fallback_by_kind:
+            queue = self._by_kind.get(kind)
+            while queue:
+                event = queue.popleft()
+                if not event.get("_used"):
+                    return self._use(event)
+
+        message = f"記録にない上流呼び出しです: kind={kind} key={key}"
+        self.mismatches.append(message)
+        raise ReplayMismatchError(message)
+
+    def _use(self, event: Dict[str, Any]) -> Any:
+        event["_used"] = True
+        self.consumed += 1
+        return event["response"]
+
+    @property
+    def unconsumed(self) -> int:
+        """リプレイで使われなかった記録の件数"""
+        return sum(1 for event in self.events if not event.get("_used"))
+
+    def latency_for(self, kind: str) -> float:
+        seconds = self.latency.get(kind, self.latency.get("*", 0.0))
+        self.injected_seconds += seconds
+        return seconds
+
+
+def _key_part(value: Any) -> Any:
+    """キー計算用にJSON化できる形へ変換（それ以外のオブジェクトは型名のみ）"""
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    if isinstance(value, dict):
+        return {str(k): _key_part(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [_key_part(v) for v in value]
+    if hasattr(value, "content") and hasattr(value, "type"):
+        # Langchainのメッセージ
+        return [value.type, value.content]
+    if isinstance(getattr(value, "text", None), str):
+        # SQLAlchemyのtext()
+        return value.text
+    return type(value).__name__
+
+
+def make_key(name: str, *args: Any, **kwargs: Any) -> str:
+    """呼び出しを識別するキーを計算"""
+    payload = json.dumps(
+        [name, _key_part(args), _key_part(kwargs)],
+        ensure_ascii=False,
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _to_jsonable(value: Any) -> Any:
+    """記録用にJSON化できる形へ変換（SQLAlchemyの行などはリストにする）"""
+    return json.loads(json.dumps(value, ensure_ascii=False, default=_json_default))
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (tuple, set, frozenset)) or hasattr(value, "_mapping"):
+        return list(value)
+    return str(value)
+
+
+def captured(kind: str) -> Callable:
+    """
+    上流呼び出しを記録・再生するデコレーター（同期・非同期関数に対応）
+
+    Args:
+        kind: 呼び出しの種別（"embedding", "db" など）
+    """
+    def decorator(func: Callable) -> Callable:
+        name = func.__qualname__
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                session = _current_session.get()
+                if session is None or _inside_capture.get():
+                    return await func(*args, **kwargs)
+                key = make_key(name, *args, **kwargs)
+                if session.replaying:
+                    await asyncio.sleep(session.latency_for(kind))
+                    return session.take(kind, key)
+                started = time.perf_counter()
+                token = _inside_capture.set(True)
+                try:
+                    response = await func(*args, **kwargs)
+                finally:
+                    _inside_capture.reset(token)
+                # 記録はJSON化したコピー、呼び出し側には元の戻り値を返す
+                session.record(kind, key, _to_jsonable(response), time.perf_counter() - started)
+                return response
+            return async_wrapper
+
+        @functools.wraps(func)
+        def sync_wrapper(*args, **kwargs):
+            session = _current_session.get()
+            if session is None or _inside_capture.get():
+                return func(*args, **kwargs)
+            key = make_key(name, *args, **kwargs)
+            if session.replaying:
+                time.sleep(session.latency_for(kind))
+                return session.take(kind, key)
+            started = time.perf_counter()
+            token = _inside_capture.set(True)
+            try:
+                response = func(*args, **kwargs)
+            finally:
+                _inside_capture.reset(token)
+            session.record(kind, key, _to_jsonable(response), time.perf_counter() - started)
+            return response
+        return sync_wrapper
+
+    return decorator
+
+
+class CapturingChatModel:
+    """LLMの ainvoke を記録・再生するラッパー（それ以外の属性は元のLLMに委譲）"""
+
+    def __init__(self, llm: Any, kind: str = "llm"):
+        self._llm = llm
+        self._kind = kind
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._llm, name)
+
+    def bind(self, **kwargs: Any) -> "CapturingChatModel":
+        return CapturingChatModel(self._llm.bind(**kwargs), self._kind)
+
+    async def ainvoke(self, messages: Any, *args: Any, **kwargs: Any) -> Any:
+        session = _current_session.get()
+        if session is None:
+            return await self._llm.ainvoke(messages, *args, **kwargs)
+
+        from langchain_core.messages import AIMessage
+
+        key = make_key("llm.ainvoke", messages, *args, **kwargs)
+        if session.replaying:
+            await asyncio.sleep(session.latency_for(self._kind))
+            return AIMessage(**session.take(self._kind, key))
+
+        started = time.perf_counter()
+        response = await self._llm.ainvoke(messages, *args, **kwargs)
+        session.record(
+            self._kind,
+            key,
+            _to_jsonable({
+                "content": response.content,
+                "additional_kwargs": getattr(response, "additional_kwargs", {}),
+                "response_metadata": getattr(response, "response_metadata", {}),
+            }),
+            time.perf_counter() - started,
+        )
+        return response
+
+
+def redact(text: str) -> str:
+    """APIキーを伏せ字にする"""
+    api_key = os.getenv("OPENAI_API_KEY")
+    if api_key:
+        text = text.replace(api_key, REDACTED)
+    return API_KEY_PATTERN.sub(REDACTED, text)
+
+
+def _append_record(path: str, record: Dict[str, Any]) -> None:
+    line = redact(json.dumps(record, ensure_ascii=False, default=_json_default))
+    with _write_lock:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+@asynccontextmanager
+async def capture_request(request: Dict[str, Any]) -> AsyncIterator[Optional[CaptureSession]]:
+    """
+    ブロック内の上流呼び出しを記録し、終了時にCAPTURE_PATHへ追記する
+
+    Args:
+        request: 記録するリクエスト入力
+    """
+    if not CAPTURE_PATH:
+        yield None
+        return
+
+    session = CaptureSession("record")
+    token = _current_session.set(session)
+    started = time.perf_counter()
+    error = None
+    try:
+        yield session
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        _current_session.reset(token)
+        record = {
+            "captured_at": datetime.now(timezone.utc).isoformat(),
+            "request": _to_jsonable(request),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+            "error": error,
+            "events": session.events,
+        }
+        try:
+            await asyncio.to_thread(_append_record, CAPTURE_PATH, record)
+        except Exception as e:
+            print(f"キャプチャ書き込みエラー: {e}")
+
+
+def current_session() -> Optional[CaptureSession]:
+    """現在のコンテキストで有効なキャプチャ・リプレイセッション（なければNone）"""
+    return _current_session.get()
+
+
+@contextmanager
+def replay_session(session: CaptureSession) -> Iterator[CaptureSession]:
+    """ブロック内の上流呼び出しを session の記録で置き換える"""
+    token = _current_session.set(session)
+    try:
+        yield session
+    finally:
+        _current_session.reset(token)
+
+
+def load_captures(path: str) -> List[Dict[str, Any]]:
+    """キャプチャファイルを読み込む"""
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
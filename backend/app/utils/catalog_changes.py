@@ -0,0 +1,313 @@
+"""製品カテゴリの変更フィード（変更ログの差分ポーリング）
+
+product_categories への INSERT / UPDATE / DELETE はトリガーで
+product_category_changes に記録される。バックエンドは変更ログを差分ポーリングし、
+変更のあったIDだけを購読者に通知する。
+
+version（BIGSERIAL）は採番順でありコミット順ではないため、version の最大値を基準にすると
+長いトランザクション（一括取り込みなど）の変更を取りこぼす。そのため、スナップショットの xmin
+（これより前のトランザクションは全て完了している）以降に書き込まれた変更を毎回読み直し、
+通知済みの version を除いて通知する。
+
+派生データ（キャッシュ・インデックスなど）は、直近のポーリングが成功している間（healthy）のみ使う。
+DBに接続できない・マイグレーションが未適用などでポーリングが失敗し続けると、
+変更が通知されないまま古い内容を返し続けてしまうため。
+"""
+import asyncio
+import inspect
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+
+# ポーリング間隔（秒）
+CATALOG_POLL_INTERVAL = float(os.getenv("CATALOG_POLL_INTERVAL", "5"))
+# 1回のポーリングで取り込む変更件数の上限（超えた場合は全件再読み込み扱い）
+CATALOG_CHANGE_BATCH_LIMIT = int(os.getenv("CATALOG_CHANGE_BATCH_LIMIT", "1000"))
+# 変更ログの保持期間（時間、0の場合は削除しない）
+CATALOG_CHANGE_RETENTION_HOURS = float(os.getenv("CATALOG_CHANGE_RETENTION_HOURS", "168"))
+# 古い変更ログを削除する間隔（秒）
+CATALOG_CHANGE_PRUNE_INTERVAL = float(os.getenv("CATALOG_CHANGE_PRUNE_INTERVAL", "3600"))
+# 最後にポーリングが成功してから、ポーリング間隔の何回分まで正常とみなすか
+CATALOG_FEED_HEALTHY_POLLS = float(os.getenv("CATALOG_FEED_HEALTHY_POLLS", "3"))
+
+
+@dataclass
+class CatalogChange:
+    """ポーリング1回分の変更内容"""
+    version: int
+    inserted_ids: Set[int] = field(default_factory=set)
+    updated_ids: Set[int] = field(default_factory=set)
+    deleted_ids: Set[int] = field(default_factory=set)
+    full_reload: bool = False  # Trueの場合、派生データは全て作り直す
+
+    @property
+    def changed_ids(self) -> Set[int]:
+        """変更のあった全てのID"""
+        return self.inserted_ids | self.updated_ids | self.deleted_ids
+
+
+CatalogChangeCallback = Callable[[CatalogChange], Any]
+
+
+class CatalogChangeFeed:
+    """product_category_changes をポーリングして購読者に変更を通知する"""
+
+    def __init__(
+        self,
+        engine: Engine,
+        poll_interval: float = CATALOG_POLL_INTERVAL,
+        batch_limit: int = CATALOG_CHANGE_BATCH_LIMIT
+    ):
+        self.engine = engine
+        self.poll_interval = poll_interval
+        self.batch_limit = batch_limit
+        # 通知済みの変更の最大version（スナップショット・推薦テーブルの鮮度判定に使う）
+        self.version = 0
+        # 変更を通知するたびに増える番号（取得中に変更が届いたかの判定に使う）
+        self.generation = 0
+        # ポーリングの基準にするトランザクションID（これより前のトランザクションは完了済み）
+        self._xmin: Optional[int] = None
+        # xmin 以降に書き込まれた通知済みの変更（version -> トランザクションID）
+        self._delivered: Dict[int, int] = {}
+        self._callbacks: List[CatalogChangeCallback] = []
+        self._task: Optional[asyncio.Task] = None
+        self._last_pruned = 0.0
+        # 最後にポーリング（初期化を含む）が成功して変更を通知し終えた時刻
+        self._last_success: Optional[float] = None
+
+    @property
+    def running(self) -> bool:
+        """ポーリングが動いているか"""
+        return self._task is not None and not self._task.done()
+
+    @property
+    def healthy(self) -> bool:
+        """
+        変更が通知されている状態か
+
+        ポーリングが動いていて、直近（ポーリング間隔 x CATALOG_FEED_HEALTHY_POLLS 以内）に
+        成功している場合のみTrue。派生データはこれがTrueの間のみ使う
+        """
+        if not self.running or self._last_success is None:
+            return False
+        return time.monotonic() - self._last_success <= self.poll_interval * CATALOG_FEED_HEALTHY_POLLS
+
+    @property
+    def seconds_since_success(self) -> Optional[float]:
+        """最後にポーリングが成功してからの秒数（一度も成功していない場合はNone）"""
+        if self._last_success is None:
+            return None
+        return time.monotonic() - self._last_success
+
+    def subscribe(self, callback: CatalogChangeCallback) -> None:
+        """変更通知のコールバックを登録（同期・非同期どちらも可）"""
+        if callback not in self._callbacks:
+            self._callbacks.append(callback)
+
+    def unsubscribe(self, callback: CatalogChangeCallback) -> None:
+        """コールバックの登録を解除"""
+        if callback in self._callbacks:
+            self._callbacks.remove(callback)
+
+    def fetch_latest_version(self) -> int:
+        """変更ログの最新versionを取得"""
+        with self.engine.connect() as conn:
+            result = conn.execute(
+                text('SELECT COALESCE(MAX("version"), 0) FROM product_category_changes')
+            )
+            return int(result.scalar() or 0)
+
+    def _fetch_xmin(self, conn) -> int:
+        """現在のスナップショットのxmin（これより前のトランザクションは完了済み）"""
+        result = conn.execute(text("SELECT CAST(pg_snapshot_xmin(pg_current_snapshot()) AS text)"))
+        return int(result.scalar())
+
+    def _fetch_window(self, conn, xmin: int) -> Dict[int, int]:
+        """xmin 以降のトランザクションが書き込んだ変更のversionとトランザクションID"""
+        rows = conn.execute(
+            text("""
+                SELECT "version", CAST("xact_id" AS text)
+                FROM product_category_changes
+                WHERE "xact_id" >= CAST(:xmin AS xid8)
+            """),
+            {"xmin": str(xmin)}
+        ).fetchall()
+        return {int(version): int(xact_id) for version, xact_id in rows}
+
+    def initialize(self) -> None:
+        """現在の変更ログを通知済みとして、ポーリングの基準を設定する"""
+        with self.engine.connect() as conn:
+            xmin = self._fetch_xmin(conn)
+            self._delivered = self._fetch_window(conn, xmin)
+        self._xmin = xmin
+        self.version = self.fetch_latest_version()
+
+    def fetch_changes(self) -> Optional[CatalogChange]:
+        """
+        前回以降にコミットされた変更を取得し、ポーリングの基準を進める
+
+        Returns:
+            変更内容（変更がない場合はNone）
+        """
+        if self._xmin is None:
+            self.initialize()
+            return None
+
+        sql_query = text("""
+            SELECT "version", "category_id", "op", CAST("xact_id" AS text)
+            FROM product_category_changes
+            WHERE "xact_id" >= CAST(:since_xmin AS xid8)
+              AND NOT ("version" = ANY(:delivered))
+            ORDER BY "version"
+            LIMIT :limit
+        """)
+
+        with self.engine.connect() as conn:
+            # 先にxminを取得する（xmin より前のトランザクションの変更は、この後の読み取りで全て見える）
+            xmin = self._fetch_xmin(conn)
+            rows = conn.execute(
+                sql_query,
+                {
+                    "since_xmin": str(self._xmin),
+                    "delivered": list(self._delivered),
+                    "limit": self.batch_limit + 1,
+                }
+            ).fetchall()
+
+            if len(rows) > self.batch_limit:
+                # 大量更新（再シードなど）は差分を追わずに全件再読み込みさせる
+                self._delivered = self._fetch_window(conn, xmin)
+                self._xmin = xmin
+                change = CatalogChange(version=self.fetch_latest_version(), full_reload=True)
+                self.version = max(self.version, change.version)
+                self.generation += 1
+                return change
+
+        delivered = {version: xact_id for version, xact_id in self._delivered.items() if xact_id >= xmin}
+        for version, _, _, xact_id in rows:
+            if int(xact_id) >= xmin:
+                delivered[int(version)] = int(xact_id)
+        self._delivered = delivered
+        self._xmin = xmin
+
+        if not rows:
+            return None
+
+        change = CatalogChange(version=max(self.version, int(rows[-1][0])))
+        for _, category_id, op, _ in rows:
+            # 同じIDへの複数の変更は最後の操作を優先する
+            change.inserted_ids.discard(category_id)
+            change.updated_ids.discard(category_id)
+            change.deleted_ids.discard(category_id)
+            if op == "INSERT":
+                change.inserted_ids.add(category_id)
+            elif op == "DELETE":
+                change.deleted_ids.add(category_id)
+            else:
+                change.updated_ids.add(category_id)
+
+        self.version = change.version
+        self.generation += 1
+        return change
+
+    def prune(self, retention_hours: float = CATALOG_CHANGE_RETENTION_HOURS) -> int:
+        """
+        保持期間を過ぎた変更ログを削除する（最新の1件は鮮度判定のため残す）
+
+        Returns:
+            削除した件数
+        """
+        if retention_hours <= 0:
+            return 0
+        sql_query = text("""
+            DELETE FROM product_category_changes
+            WHERE "changed_at" < now() - (:hours * interval '1 hour')
+              AND "xact_id" < pg_snapshot_xmin(pg_current_snapshot())
+              AND "version" < (SELECT MAX("version") FROM product_category_changes)
+        """)
+        with self.engine.begin() as conn:
+            return conn.execute(sql_query, {"hours": retention_hours}).rowcount
+
+    async def poll_once(self) -> Optional[CatalogChange]:
+        """1回ポーリングし、変更があれば購読者に通知する"""
+        change = await asyncio.to_thread(self.fetch_changes)
+        if change is not None:
+            await self._notify(change)
+        # 通知し終えてから成功とする（障害から復旧した直後に、未通知の変更がある状態で使われないように）
+        self._last_success = time.monotonic()
+        return change
+
+    def metrics(self) -> Dict[str, Any]:
+        """メトリクスを取得"""
+        seconds_since_success = self.seconds_since_success
+        return {
+            "running": self.running,
+            "healthy": self.healthy,
+            "version": self.version,
+            "seconds_since_success": round(seconds_since_success, 3) if seconds_since_success is not None else None,
+        }
+
+    async def _notify(self, change: CatalogChange) -> None:
+        for callback in list(self._callbacks):
+            try:
+                result = callback(change)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                print(f"カタログ変更通知エラー: {e}")
+
+    async def start(self) -> None:
+        """現在のversionを基準にしてポーリングを開始"""
+        if self._task is not None:
+            return
+        try:
+            await asyncio.to_thread(self.initialize)
+            self._last_success = time.monotonic()
+        except Exception as e:
+            # 初期化できなかった場合は最初のポーリングで再試行する
+            print(f"カタログ変更ログの取得エラー: {e}")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """ポーリングを停止"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._last_success = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.poll_once()
+            except Exception as e:
+                print(f"カタログ変更ポーリングエラー: {e}")
+            if time.monotonic() - self._last_pruned >= CATALOG_CHANGE_PRUNE_INTERVAL:
+                self._last_pruned = time.monotonic()
+                try:
+                    await asyncio.to_thread(self.prune)
+                except Exception as e:
+                    print(f"カタログ変更ログの削除エラー: {e}")
+
+
+# グローバルなフィードインスタンス
+_feed: Optional[CatalogChangeFeed] = None
+
+
+def get_catalog_change_feed() -> CatalogChangeFeed:
+    """カタログ変更フィードを取得（シングルトン）"""
+    global _feed
+    if _feed is None:
+        from app.utils.search_categories import engine
+        _feed = CatalogChangeFeed(engine)
+    return _feed
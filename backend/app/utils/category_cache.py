@@ -0,0 +1,105 @@
+"""製品カテゴリ行のプロセス内キャッシュ
+
+IDで参照されるカテゴリ行（説明文を含む）を毎回DBから取得・辞書化しないよう、
+カタログ変更フィードと連動したLRUキャッシュに保持する。変更のあったIDだけを破棄するため、
+フィードのポーリングが正常な（変更が届いている）間のみキャッシュを使用する。
+別スレッド（asyncio.to_thread）からも参照されるため、操作はロックで保護する。
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.utils.catalog_changes import CatalogChange, CatalogChangeFeed, get_catalog_change_feed
+
+
+# キャッシュする最大行数
+CATEGORY_CACHE_SIZE = int(os.getenv("CATEGORY_CACHE_SIZE", "10000"))
+
+
+class CategoryCache:
+    """カテゴリIDをキーにしたLRUキャッシュ"""
+
+    def __init__(self, feed: CatalogChangeFeed, max_size: int = CATEGORY_CACHE_SIZE):
+        self.feed = feed
+        self.max_size = max_size
+        self._rows: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        feed.subscribe(self.on_catalog_change)
+
+    @property
+    def enabled(self) -> bool:
+        """変更フィードが正常な（無効化が届いている）場合のみ有効"""
+        return self.max_size > 0 and self.feed.healthy
+
+    def get_many(self, ids: Iterable[int]) -> Tuple[Dict[int, Dict[str, Any]], List[int]]:
+        """
+        キャッシュ済みの行と、キャッシュにないIDを返す
+
+        Returns:
+            (ID -> カテゴリ辞書, 未キャッシュのIDのリスト)
+        """
+        found: Dict[int, Dict[str, Any]] = {}
+        missing: List[int] = []
+        enabled = self.enabled
+        with self._lock:
+            for category_id in ids:
+                category = self._rows.get(category_id) if enabled else None
+                if category is None:
+                    missing.append(category_id)
+                    continue
+                self._rows.move_to_end(category_id)
+                found[category_id] = category
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def put_many(self, categories: Iterable[Dict[str, Any]], generation: int) -> None:
+        """
+        行をキャッシュに追加
+
+        Args:
+            categories: DBから取得した行
+            generation: 取得前の変更フィードのgeneration（取得中に変更が届いていれば追加しない）
+        """
+        with self._lock:
+            if not self.enabled or generation != self.feed.generation:
+                return
+            for category in categories:
+                self._rows[category["id"]] = category
+                self._rows.move_to_end(category["id"])
+            while len(self._rows) > self.max_size:
+                self._rows.popitem(last=False)
+
+    def on_catalog_change(self, change: CatalogChange) -> None:
+        """変更のあったIDだけを破棄する（全件再読み込みの場合は全て破棄）"""
+        with self._lock:
+            if change.full_reload:
+                self._rows.clear()
+                return
+            for category_id in change.changed_ids:
+                self._rows.pop(category_id, None)
+
+    def metrics(self) -> Dict[str, Any]:
+        """メトリクスを取得"""
+        return {
+            "enabled": self.enabled,
+            "size": len(self._rows),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+# グローバルなキャッシュインスタンス
+_cache: Optional[CategoryCache] = None
+
+
+def get_category_cache() -> CategoryCache:
+    """カテゴリキャッシュを取得（シングルトン）"""
+    global _cache
+    if _cache is None:
+        _cache = CategoryCache(get_catalog_change_feed())
+    return _cache
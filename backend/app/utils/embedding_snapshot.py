@@ -0,0 +1,186 @@
+"""カタログembeddingのバイナリスナップショット（mmapで複数ワーカー間共有）
+
+scripts/generate_embeddings.py が書き出したスナップショットを読み取り専用でmmapし、
+行列をコピーせずにnumpy配列として参照する。同じファイルを開いた全てのuvicornワーカーは
+OSのページキャッシュ上の1つのコピーを共有し、起動時にDBを参照する必要もない。
+
+ファイル形式（リトルエンディアン）:
+    ヘッダー（64バイト）: magic, 形式バージョン, 次元数, 件数, カタログ変更version, 作成日時
+    float32[件数 x 次元数]: L2正規化済みのembedding行列
+    int64[件数]: 行ごとのカテゴリID
+"""
+import mmap
+import os
+import struct
+import time
+from pathlib import Path
+from typing import BinaryIO, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+MAGIC = b"OLNEMBS\x00"
+FORMAT_VERSION = 1
+HEADER_STRUCT = struct.Struct("<8sIIQQd")
+HEADER_SIZE = 64
+
+# スナップショットの配置場所（全ワーカーで同じファイルを参照する）
+DEFAULT_SNAPSHOT_PATH = Path(__file__).resolve().parent.parent / "data" / "embeddings.snapshot"
+EMBEDDING_SNAPSHOT_PATH = Path(os.getenv("EMBEDDING_SNAPSHOT_PATH", str(DEFAULT_SNAPSHOT_PATH)))
+
+
+class SnapshotFormatError(ValueError):
+    """スナップショットのファイル形式が不正"""
+
+
+class EmbeddingSnapshot:
+    """mmapしたembeddingスナップショット"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with self.path.open("rb") as f:
+            stat = os.fstat(f.fileno())
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.file_id = (stat.st_ino, stat.st_mtime_ns)
+
+        if len(self._mmap) < HEADER_SIZE:
+            raise SnapshotFormatError(f"スナップショットが短すぎます: {self.path}")
+
+        magic, format_version, dimensions, count, catalog_version, created_at = \
+            HEADER_STRUCT.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise SnapshotFormatError(f"スナップショットではありません: {self.path}")
+        if format_version != FORMAT_VERSION:
+            raise SnapshotFormatError(f"未対応のスナップショット形式です: v{format_version}")
+
+        matrix_size = count * dimensions * 4
+        expected_size = HEADER_SIZE + matrix_size + count * 8
+        if len(self._mmap) != expected_size:
+            raise SnapshotFormatError(f"スナップショットのサイズが不正です: {self.path}")
+
+        self.dimensions = dimensions
+        self.count = count
+        self.catalog_version = catalog_version
+        self.created_at = created_at
+
+        # np.frombufferはmmapを直接参照するため、行列はコピーされない
+        self.matrix = np.frombuffer(
+            self._mmap, dtype="<f4", count=count * dimensions, offset=HEADER_SIZE
+        ).reshape(count, dimensions)
+        self.ids = np.frombuffer(
+            self._mmap, dtype="<i8", count=count, offset=HEADER_SIZE + matrix_size
+        )
+
+    def search(self, query_embedding: Sequence[float], limit: int = 20) -> List[Tuple[int, float]]:
+        """
+        コサイン類似度の上位を返す
+
+        Args:
+            query_embedding: クエリのベクトル
+            limit: 取得件数
+
+        Returns:
+            (カテゴリID, 類似度) のリスト（類似度の降順）
+        """
+        if self.count == 0 or limit <= 0:
+            return []
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+        scores = self.matrix @ (query / norm)
+
+        limit = min(limit, self.count)
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(self.ids[i]), float(scores[i])) for i in top]
+
+
+def write_snapshot(
+    path: Path,
+    rows: Iterable[Tuple[int, Sequence[float]]],
+    count: int,
+    dimensions: int,
+    catalog_version: int
+) -> int:
+    """
+    スナップショットを書き出し、既存ファイルをアトミックに置き換える
+
+    Args:
+        path: 出力先
+        rows: (カテゴリID, ベクトル) のイテレータ
+        count: 行数（ヘッダーに記録する）
+        dimensions: ベクトルの次元数
+        catalog_version: 書き出し時点のカタログ変更version
+
+    Returns:
+        書き出した行数
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.tmp-{os.getpid()}")
+
+    ids = np.empty(count, dtype="<i8")
+    written = 0
+    try:
+        with tmp_path.open("wb") as f:
+            _write_header(f, dimensions, count, catalog_version)
+            for category_id, embedding in rows:
+                if written >= count:
+                    raise ValueError("行数がヘッダーの件数を超えています")
+                vector = np.asarray(embedding, dtype="<f4")
+                if vector.shape != (dimensions,):
+                    raise ValueError(f"次元数が一致しません: id={category_id}")
+                norm = np.linalg.norm(vector)
+                if norm > 0:
+                    vector = vector / norm
+                f.write(vector.astype("<f4").tobytes())
+                ids[written] = category_id
+                written += 1
+
+            if written != count:
+                raise ValueError(f"行数がヘッダーの件数と一致しません: {written} != {count}")
+            f.write(ids.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        # 同じディレクトリ内でのrenameはアトミック（開いているワーカーは旧ファイルを参照し続ける）
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+    return written
+
+
+def _write_header(f: BinaryIO, dimensions: int, count: int, catalog_version: int) -> None:
+    header = HEADER_STRUCT.pack(MAGIC, FORMAT_VERSION, dimensions, count, catalog_version, time.time())
+    f.write(header.ljust(HEADER_SIZE, b"\x00"))
+
+
+# グローバルなスナップショットインスタンス
+_snapshot: Optional[EmbeddingSnapshot] = None
+
+
+def get_embedding_snapshot() -> Optional[EmbeddingSnapshot]:
+    """
+    スナップショットを取得（ファイルが置き換えられていれば開き直す）
+
+    Returns:
+        スナップショット（ファイルがない・読み込めない場合はNone）
+    """
+    global _snapshot
+    try:
+        stat = os.stat(EMBEDDING_SNAPSHOT_PATH)
+    except FileNotFoundError:
+        _snapshot = None
+        return None
+
+    if _snapshot is None or _snapshot.file_id != (stat.st_ino, stat.st_mtime_ns):
+        try:
+            _snapshot = EmbeddingSnapshot(EMBEDDING_SNAPSHOT_PATH)
+        except (OSError, SnapshotFormatError) as e:
+            print(f"Embeddingスナップショット読み込みエラー: {e}")
+            _snapshot = None
+    return _snapshot
@@ -3,6 +3,8 @@ import os
 from typing import List, Optional
 from openai import AsyncOpenAI
 import asyncio
+from app.utils.capture import captured
+from app.utils.http_client import get_http_client
 
 
 # グローバルなクライアントインスタンス
@@ -12,14 +14,17 @@ _client: Optional[AsyncOpenAI] = None
 def get_openai_client() -> AsyncOpenAI:
     """OpenAIクライアントを取得（シングルトン）"""
     global _client
-    if _client is None:
+    if _client is None or _client.is_closed():
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise ValueError("OPENAI_API_KEYが設定されていません")
-        _client = AsyncOpenAI(api_key=api_key)
+        # チャット用のLLMと接続プール・タイムアウトを共有する
+        http_client = get_http_client()
+        _client = AsyncOpenAI(api_key=api_key, http_client=http_client, timeout=http_client.timeout)
     return _client
 
 
+@captured("embedding")
 async def get_embedding(
     text: str,
     model: str = "text-embedding-3-small",
@@ -50,6 +55,7 @@ async def get_embedding(
         raise
 
 
+@captured("embedding")
 async def get_embeddings_batch(
     texts: List[str],
     model: str = "text-embedding-3-small",
@@ -0,0 +1,94 @@
+"""OpenAI API呼び出しで共有する非同期HTTPクライアント
+
+Embedding用の AsyncOpenAI とチャット用の ChatOpenAI が同じ接続プールを使うよう、
+httpx.AsyncClient を1つだけ作成する。起動時に接続を確立しておき、
+各リクエストの最初の呼び出しでTLSハンドシェイクが発生しないようにする。
+"""
+import asyncio
+import os
+from typing import Optional
+
+import httpx
+
+
+# OpenAI APIのベースURL（ウォームアップの接続先）
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+# HTTP/2 を使うか（1接続で複数のリクエストを多重化できる）
+HTTP_CLIENT_HTTP2 = os.getenv("HTTP_CLIENT_HTTP2", "true").lower() in ("1", "true", "yes")
+# 接続数の上限と、保持するアイドル接続数の上限
+HTTP_CLIENT_MAX_CONNECTIONS = int(os.getenv("HTTP_CLIENT_MAX_CONNECTIONS", "100"))
+HTTP_CLIENT_MAX_KEEPALIVE = int(os.getenv("HTTP_CLIENT_MAX_KEEPALIVE", "20"))
+# アイドル接続を保持する時間（秒）
+HTTP_CLIENT_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_CLIENT_KEEPALIVE_EXPIRY", "60"))
+# 接続確立と全体のタイムアウト（秒）
+HTTP_CLIENT_CONNECT_TIMEOUT = float(os.getenv("HTTP_CLIENT_CONNECT_TIMEOUT", "5"))
+HTTP_CLIENT_TIMEOUT = float(os.getenv("HTTP_CLIENT_TIMEOUT", "60"))
+# 起動時に確立しておく接続数（0でウォームアップしない）
+HTTP_CLIENT_WARMUP_CONNECTIONS = int(os.getenv("HTTP_CLIENT_WARMUP_CONNECTIONS", "2"))
+
+
+# グローバルなクライアントインスタンス
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _http2_available() -> bool:
+    """HTTP/2 に必要な h2 パッケージがあるか"""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """共有のHTTPクライアントを取得（シングルトン）"""
+    global _client
+    if _client is None or _client.is_closed:
+        http2 = HTTP_CLIENT_HTTP2 and _http2_available()
+        if HTTP_CLIENT_HTTP2 and not http2:
+            print("HTTP/2 を使うには h2 パッケージが必要です（pip install 'httpx[http2]'）。HTTP/1.1 で接続します")
+        _client = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=HTTP_CLIENT_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_CLIENT_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_CLIENT_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(HTTP_CLIENT_TIMEOUT, connect=HTTP_CLIENT_CONNECT_TIMEOUT),
+            follow_redirects=True
+        )
+    return _client
+
+
+async def warm_up_http_client(connections: int = HTTP_CLIENT_WARMUP_CONNECTIONS) -> None:
+    """
+    OpenAI APIへの接続を事前に確立する
+
+    Args:
+        connections: 並行して確立する接続数（HTTP/2 の場合は1接続に多重化される）
+    """
+    if connections <= 0:
+        return
+    client = get_http_client()
+    headers = {}
+    api_key = os.getenv("OPENAI_API_KEY")
+    if api_key:
+        headers["Authorization"] = f"Bearer {api_key}"
+
+    # 応答の内容は使わない（TCP・TLSの確立と接続プールへの保持が目的）
+    results = await asyncio.gather(
+        *[client.get(f"{OPENAI_BASE_URL}/models", headers=headers) for _ in range(connections)],
+        return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"HTTP接続のウォームアップエラー: {result}")
+            break
+
+
+async def close_http_client() -> None:
+    """共有のHTTPクライアントを閉じる"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
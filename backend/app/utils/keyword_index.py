@@ -0,0 +1,377 @@
+"""キーワード検索用のプロセス内転置インデックス
+
+name / description / suitable_for から文字bigram（日本語は分かち書きせずに扱えるため）の
+転置インデックスを作り、キーワード検索をDBに問い合わせずに行う。候補はbigramの
+ポスティングの積集合で絞り込み、部分一致（ILIKE と同じ条件）で確認してからBM25で順位付けする。
+
+ポスティングは文書番号の昇順に並べた文書番号とbigram出現回数の array に保持し、
+積集合もスコア計算も numpy の二分探索（searchsorted）で一致した文書だけを調べる。カタログの変更は
+変更フィードで受け取り、変更のあった行だけを差し替える（古い文書番号は削除済みとして扱い、
+一定以上たまったら詰め直す）。全件の構築と詰め直しは別スレッドで新しいインデックスを作ってから
+差し替えるため、その間もイベントループと検索は止まらない。
+カテゴリキャッシュと同じく、フィードが正常な（変更が届いている）間のみ使用する。
+"""
+import asyncio
+import math
+import os
+import re
+import threading
+import unicodedata
+from array import array
+from collections import Counter
+from itertools import islice
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.utils.catalog_changes import CatalogChange, CatalogChangeFeed, get_catalog_change_feed
+
+
+# インデックスを使うか（falseの場合は常にDBでキーワード検索する）
+KEYWORD_INDEX_ENABLED = os.getenv("KEYWORD_INDEX_ENABLED", "true").lower() in ("1", "true", "yes")
+# BM25のパラメータ
+BM25_K1 = 1.2
+BM25_B = 0.75
+# 削除済みの文書番号がこの割合を超えたら詰め直す
+COMPACT_RATIO = 0.25
+
+_SEPARATOR = re.compile(r"[\s,、。・/()（）「」]+")
+
+
+def normalize_text(value: str) -> str:
+    """全角・半角や大文字・小文字の違いを吸収する"""
+    return unicodedata.normalize("NFKC", value or "").lower()
+
+
+def char_bigrams(value: str) -> List[str]:
+    """
+    正規化済みテキストを文字bigramに分割（区切り文字をまたがない）
+
+    1文字だけの語はそのまま1つの要素にする
+    """
+    grams = []
+    for segment in _SEPARATOR.split(value):
+        if len(segment) == 1:
+            grams.append(segment)
+        grams.extend(segment[i:i + 2] for i in range(len(segment) - 1))
+    return grams
+
+
+def _document_text(category: Dict[str, Any]) -> str:
+    """インデックス対象の列を1つのテキストにする（列の境界は改行）"""
+    parts = [category.get("name") or "", category.get("description") or ""]
+    parts.extend(category.get("suitable_for") or [])
+    return normalize_text("\n".join(parts))
+
+
+_EMPTY_SLOTS = np.empty(0, dtype=np.int64)
+
+
+def _contained(postings: np.ndarray, slots: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    文書番号の昇順に並んだポスティングを二分探索する
+
+    Returns:
+        (slots の各要素の位置, ポスティングに含まれるか)
+    """
+    positions = np.minimum(np.searchsorted(postings, slots), len(postings) - 1)
+    return positions, postings[positions] == slots
+
+
+class _IndexData:
+    """転置インデックスの中身（作り直す場合は別スレッドで新しく作って差し替える）"""
+
+    def __init__(self):
+        # 文書番号ごとの情報（削除済みの番号は alive が0）
+        self.categories: List[Optional[Dict[str, Any]]] = []
+        self.texts: List[str] = []
+        self.lengths = array("I")
+        self.alive = bytearray()
+        # カテゴリID -> 文書番号
+        self.slots: Dict[int, int] = {}
+        # bigram -> (文書番号の配列, 出現回数の配列)。文書番号は追加順（昇順）に並ぶ
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.df: Counter = Counter()
+        self.total_length = 0
+        self.dead = 0
+        # 追加・削除の回数（詰め直し中に変更があったかの判定に使う）
+        self.mutations = 0
+
+    @classmethod
+    def from_categories(cls, categories: Iterable[Dict[str, Any]]) -> "_IndexData":
+        """全件からインデックスを作る"""
+        data = cls()
+        for category in categories:
+            data.add(category)
+        return data
+
+    @property
+    def needs_compaction(self) -> bool:
+        return self.dead > len(self.alive) * COMPACT_RATIO
+
+    def live_categories(self) -> List[Dict[str, Any]]:
+        return [category for category in self.categories if category is not None]
+
+    def add(self, category: Dict[str, Any]) -> None:
+        slot = len(self.alive)
+        document = _document_text(category)
+        counts = Counter(char_bigrams(document))
+        self.categories.append(category)
+        self.texts.append(document)
+        length = sum(counts.values())
+        self.lengths.append(length)
+        self.alive.append(1)
+        self.slots[category["id"]] = slot
+        self.total_length += length
+        self.mutations += 1
+        postings = self.postings
+        for gram, count in counts.items():
+            entry = postings.get(gram)
+            if entry is None:
+                entry = postings[gram] = (array("I"), array("H"))
+            entry[0].append(slot)
+            entry[1].append(min(count, 0xFFFF))
+        self.df.update(counts.keys())
+
+    def remove(self, category_id: int) -> None:
+        slot = self.slots.pop(category_id, None)
+        if slot is None:
+            return
+        self.alive[slot] = 0
+        self.dead += 1
+        self.total_length -= self.lengths[slot]
+        self.mutations += 1
+        self.df.subtract(set(char_bigrams(self.texts[slot])))
+        self.categories[slot] = None
+        self.texts[slot] = ""
+
+    def matching_slots(self, needle: str, grams: List[str]) -> np.ndarray:
+        """キーワードを部分文字列として含む有効な文書番号（昇順）"""
+        if len(needle) < 2:
+            # 1文字のキーワードはbigramで絞り込めないため全件を確認する
+            return np.array([slot for slot, text in enumerate(self.texts) if needle in text], dtype=np.int64)
+        if not grams:
+            # 区切り文字だけのキーワード（「・・」など）はどの語にも一致しない
+            return _EMPTY_SLOTS
+        # 出現文書数の少ないbigramのポスティングから始め、他のポスティングを二分探索して絞り込む
+        ordered = sorted(set(grams), key=lambda gram: self.df.get(gram, 0))
+        candidates = None
+        for gram in ordered:
+            postings = self.postings.get(gram)
+            if postings is None:
+                return _EMPTY_SLOTS
+            slots = np.array(postings[0], dtype=np.int64)
+            if candidates is None:
+                candidates = slots
+            else:
+                candidates = candidates[_contained(slots, candidates)[1]]
+            if not len(candidates):
+                return _EMPTY_SLOTS
+        alive = np.frombuffer(bytes(self.alive), dtype=np.uint8)
+        candidates = candidates[alive[candidates] == 1]
+        if ordered == [needle]:
+            # キーワードがbigramそのものなら、ポスティングに含まれることが部分一致と同じ
+            return candidates
+        # bigramが全て含まれても連続しているとは限らないため、部分一致で確認する
+        texts = self.texts
+        return np.array([slot for slot in candidates.tolist() if needle in texts[slot]], dtype=np.int64)
+
+    def bm25_scores(self, slots: np.ndarray, grams: List[str]) -> np.ndarray:
+        """キーワードのbigramについて、一致した文書（slots）ごとのBM25スコアを計算する"""
+        totals = np.zeros(len(slots))
+        if not len(slots):
+            return totals
+        documents = len(self.slots)
+        average_length = self.total_length / documents if documents else 1.0
+        lengths = np.array(self.lengths, dtype=np.float64)[slots]
+        norms = BM25_K1 * (1 - BM25_B + BM25_B * lengths / average_length)
+        for gram in set(grams):
+            postings = self.postings.get(gram)
+            if postings is None:
+                continue
+            df = self.df[gram]
+            idf = math.log(1 + (documents - df + 0.5) / (df + 0.5))
+            # 一致した文書の出現回数だけをポスティングから二分探索で取り出す
+            positions, found = _contained(np.array(postings[0], dtype=np.int64), slots)
+            tf = np.where(found, np.array(postings[1], dtype=np.float64)[positions], 0.0)
+            totals += idf * tf * (BM25_K1 + 1) / (tf + norms)
+        return totals
+
+
+class KeywordIndex:
+    """文字bigramの転置インデックス"""
+
+    def __init__(self, feed: CatalogChangeFeed):
+        self.feed = feed
+        self.ready = False
+        self.searches = 0
+        self._lock = threading.Lock()
+        self._data = _IndexData()
+        feed.subscribe(self.on_catalog_change)
+
+    @property
+    def enabled(self) -> bool:
+        """構築済みで、変更フィードが正常な（変更が反映される）場合のみ有効"""
+        return KEYWORD_INDEX_ENABLED and self.ready and self.feed.healthy
+
+    @property
+    def size(self) -> int:
+        """インデックス内の有効な文書数"""
+        return len(self._data.slots)
+
+    def build(self, categories: Iterable[Dict[str, Any]]) -> None:
+        """
+        全件からインデックスを作り直す
+
+        新しいインデックスはロックの外で作り、完成してから差し替える
+        （作っている間も検索は古いインデックスで続けられる）
+        """
+        data = _IndexData.from_categories(categories)
+        with self._lock:
+            self._data = data
+            self.ready = True
+
+    async def load(self) -> None:
+        """DBから全件を読み込んでインデックスを作る（構築はイベントループを止めないよう別スレッドで行う）"""
+        from app.utils.search_categories import fetch_all_categories
+
+        while True:
+            # 読み込み中に届いた変更は反映されないため、変更が届いていたら読み込み直す
+            generation = self.feed.generation
+            try:
+                categories = await asyncio.to_thread(fetch_all_categories)
+                await asyncio.to_thread(self.build, categories)
+            except Exception as e:
+                print(f"キーワードインデックスの構築エラー: {e}")
+                return
+            if self.feed.generation == generation:
+                return
+
+    def update(self, categories: Iterable[Dict[str, Any]], removed_ids: Iterable[int]) -> None:
+        """
+        変更のあった行だけを差し替える
+
+        Args:
+            categories: 追加・更新された行
+            removed_ids: 削除・更新されたID（古い文書を無効にする）
+        """
+        with self._lock:
+            data = self._data
+            for category_id in removed_ids:
+                data.remove(category_id)
+            for category in categories:
+                data.remove(category["id"])
+                data.add(category)
+
+    async def on_catalog_change(self, change: CatalogChange) -> None:
+        """変更のあった行を読み込み直す（全件再読み込みの場合は作り直す）"""
+        if not self.ready:
+            return
+        if change.full_reload:
+            await self.load()
+            return
+
+        from app.utils.search_categories import _fetch_categories_by_ids
+
+        changed_ids = change.inserted_ids | change.updated_ids
+        fetched: List[Dict[str, Any]] = []
+        if changed_ids:
+            try:
+                fetched = await asyncio.to_thread(_fetch_categories_by_ids, list(changed_ids))
+            except Exception as e:
+                # 差分を取り込めなかった場合は次に使えるまで無効にする
+                print(f"キーワードインデックスの更新エラー: {e}")
+                self.ready = False
+                asyncio.create_task(self.load())
+                return
+        self.update(fetched, change.changed_ids)
+        if self._data.needs_compaction:
+            await self._compact()
+
+    def search(self, keywords: List[str], limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        いずれかのキーワードを含むカテゴリをBM25の順に返す
+
+        Args:
+            keywords: 検索キーワードのリスト
+            limit: 取得件数
+
+        Returns:
+            検索結果のカテゴリリスト
+        """
+        self.searches += 1
+        if limit <= 0:
+            return []
+        with self._lock:
+            data = self._data
+            if not keywords:
+                # キーワードがない場合は先頭から返す（DB検索と同じ）
+                slots = islice((slot for slot in range(len(data.alive)) if data.alive[slot]), limit)
+                return [dict(data.categories[slot]) for slot in slots]
+
+            matched_slots = []
+            matched_scores = []
+            for keyword in keywords:
+                needle = normalize_text(keyword).strip()
+                if not needle:
+                    continue
+                grams = char_bigrams(needle)
+                slots = data.matching_slots(needle, grams)
+                matched_slots.append(slots)
+                matched_scores.append(data.bm25_scores(slots, grams))
+            if not matched_slots:
+                return []
+
+            if len(matched_slots) == 1:
+                slots, scores = matched_slots[0], matched_scores[0]
+            else:
+                # キーワードごとのスコアを文書ごとに合計する
+                slots, inverse = np.unique(np.concatenate(matched_slots), return_inverse=True)
+                scores = np.bincount(inverse, weights=np.concatenate(matched_scores), minlength=len(slots))
+            if not len(slots):
+                return []
+            if len(slots) > limit:
+                # limit件目と同点の文書も残し、IDの順で同点を並べる
+                threshold = np.partition(scores, len(scores) - limit)[len(scores) - limit]
+                keep = scores >= threshold
+                slots, scores = slots[keep], scores[keep]
+            ranked = sorted(
+                zip(scores.tolist(), slots.tolist()),
+                key=lambda item: (-item[0], data.categories[item[1]]["id"])
+            )[:limit]
+            return [dict(data.categories[slot]) for _, slot in ranked]
+
+    def metrics(self) -> Dict[str, Any]:
+        """メトリクスを取得"""
+        data = self._data
+        return {
+            "enabled": self.enabled,
+            "documents": self.size,
+            "grams": len(data.postings),
+            "dead_slots": data.dead,
+            "searches": self.searches,
+        }
+
+    async def _compact(self) -> None:
+        """削除済みの文書番号を詰めたインデックスを別スレッドで作り、途中で変更がなければ差し替える"""
+        with self._lock:
+            data = self._data
+            mutations = data.mutations
+            categories = data.live_categories()
+        compacted = await asyncio.to_thread(_IndexData.from_categories, categories)
+        with self._lock:
+            # 作っている間に差分が反映された場合は捨てる（次の変更で詰め直す）
+            if self._data is data and data.mutations == mutations:
+                self._data = compacted
+
+
+# グローバルなインデックスインスタンス
+_index: Optional[KeywordIndex] = None
+
+
+def get_keyword_index() -> KeywordIndex:
+    """キーワードインデックスを取得（シングルトン）"""
+    global _index
+    if _index is None:
+        _index = KeywordIndex(get_catalog_change_feed())
+    return _index
@@ -0,0 +1,197 @@
+"""質問フェーズ中の検索の先読み
+
+物件情報が揃うまでの間、エージェントは質問を返すだけで検索を行わない。部屋名などが
+既に分かっていれば、ユーザーが次の入力をしている間にEmbedding検索（ベクトル検索）を
+バックグラウンドで実行しておき、次のターンの機種検索で結果を再利用する。
+
+先読みのキーは物件名を含まない（物件名が未入力の間に先読みするため）。
+結果はリクエスト間で共有できる検索結果なので、セッションではなく入力内容で照合する。
+
+先読みはアドミッション制御の外で上流を呼び出すため、同時に実行する先読みの数を制限し、
+チャットの待ち行列にリクエストが並んでいる間は開始しない（待っているリクエストを優先する）。
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.models.chat import ProjectInfo
+from app.utils.admission import get_admission_controller
+from app.utils.capture import current_session
+from app.utils.catalog_changes import CatalogChange, CatalogChangeFeed, get_catalog_change_feed
+from app.utils.recommendations import ceiling_band, normalize_room_type
+from app.utils.search_categories import search_categories
+
+
+# 先読み結果を保持する時間（秒）
+PREFETCH_TTL = float(os.getenv("PREFETCH_TTL", "300"))
+# 保持する先読みの最大件数
+PREFETCH_MAX_ENTRIES = int(os.getenv("PREFETCH_MAX_ENTRIES", "256"))
+# 同時に実行する先読みの最大数
+PREFETCH_MAX_CONCURRENCY = int(os.getenv("PREFETCH_MAX_CONCURRENCY", "2"))
+
+# (部屋名, 天井高の区分, 特殊環境)
+PrefetchKey = Tuple[str, str, bool]
+
+
+def prefetch_key(project_info: Optional[ProjectInfo]) -> Optional[PrefetchKey]:
+    """
+    先読みのキーを生成
+
+    Returns:
+        キー（部屋名が未入力で先読みできない場合はNone）
+    """
+    if project_info is None:
+        return None
+    room_type = normalize_room_type(project_info.room_name)
+    if not room_type:
+        return None
+    return (
+        room_type,
+        ceiling_band(project_info.ceiling_height),
+        bool(project_info.special_environment),
+    )
+
+
+class RetrievalPrefetcher:
+    """入力内容をキーにして検索を先読みする"""
+
+    def __init__(
+        self,
+        feed: CatalogChangeFeed,
+        ttl: float = PREFETCH_TTL,
+        max_entries: int = PREFETCH_MAX_ENTRIES,
+        max_concurrency: int = PREFETCH_MAX_CONCURRENCY
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_concurrency = max_concurrency
+        self._entries: "OrderedDict[PrefetchKey, Tuple[float, asyncio.Task]]" = OrderedDict()
+        self._running = 0
+        self.started = 0
+        self.skipped = 0
+        self.hits = 0
+        self.misses = 0
+        # カタログが変更されたら先読み結果を破棄する
+        feed.subscribe(self.on_catalog_change)
+
+    def start(self, project_info: ProjectInfo, query: str) -> bool:
+        """
+        検索の先読みをバックグラウンドで開始
+
+        Args:
+            project_info: 途中まで入力された物件情報
+            query: 先読みする自然言語クエリ
+
+        Returns:
+            先読みを開始した場合True（既に実行中・実行済み、または混雑していて見送った場合はFalse）
+        """
+        key = prefetch_key(project_info)
+        # キャプチャ・リプレイ中は上流呼び出しの順序を変えないよう先読みしない
+        if key is None or self.max_entries <= 0 or current_session() is not None:
+            return False
+
+        self._expire()
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return False
+
+        # 先読みの同時実行数が上限に達しているか、チャットの待ち行列が空でなければ見送る
+        if self._running >= self.max_concurrency or get_admission_controller().queue_depth > 0:
+            self.skipped += 1
+            return False
+
+        self._running += 1
+        task = asyncio.create_task(self._search(query))
+        # 開始前にキャンセルされた場合も数えるよう、完了時のコールバックで減らす
+        task.add_done_callback(self._on_done)
+        self._entries[key] = (time.monotonic(), task)
+        while len(self._entries) > self.max_entries:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            evicted.cancel()
+        self.started += 1
+        return True
+
+    async def take(self, project_info: ProjectInfo) -> Optional[List[Dict[str, Any]]]:
+        """
+        入力内容が一致する先読み結果を取得（実行中なら完了を待つ）
+
+        Returns:
+            Embedding検索の結果（一致する先読みがない場合はNone）
+        """
+        key = prefetch_key(project_info)
+        if key is None or current_session() is not None:
+            return None
+
+        self._expire()
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        _, task = entry
+        try:
+            # 他のリクエストが同じ先読みを待っていてもキャンセルが伝わらないようにする
+            results = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                raise
+            results = None
+        if not results:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        # 呼び出し側で候補を書き換えても共有の結果に影響しないようコピーを返す
+        return [dict(category) for category in results]
+
+    def on_catalog_change(self, change: CatalogChange) -> None:
+        """カタログが変更されたら全ての先読みを破棄する"""
+        for _, task in self._entries.values():
+            task.cancel()
+        self._entries.clear()
+
+    def metrics(self) -> Dict[str, Any]:
+        """メトリクスを取得"""
+        return {
+            "entries": len(self._entries),
+            "running": self._running,
+            "started": self.started,
+            "skipped": self.skipped,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        self._running -= 1
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        expired = [key for key, (created_at, _) in self._entries.items() if now - created_at >= self.ttl]
+        for key in expired:
+            _, task = self._entries.pop(key)
+            task.cancel()
+
+    async def _search(self, query: str) -> Optional[List[Dict[str, Any]]]:
+        try:
+            return await search_categories(
+                query=query,
+                use_embedding=True,
+                use_llm=False
+            )
+        except Exception as e:
+            print(f"検索の先読みエラー: {e}")
+            return None
+
+
+# グローバルな先読みインスタンス
+_prefetcher: Optional[RetrievalPrefetcher] = None
+
+
+def get_retrieval_prefetcher() -> RetrievalPrefetcher:
+    """検索の先読みを取得（シングルトン）"""
+    global _prefetcher
+    if _prefetcher is None:
+        _prefetcher = RetrievalPrefetcher(get_catalog_change_feed())
+    return _prefetcher
@@ -0,0 +1,180 @@
+"""事前計算済みの推薦テーブル
+
+よく使われる部屋種別（カタログの suitable_for の語彙）× 天井高の区分 × 特殊環境フラグの
+組み合わせについて、scripts/precompute_recommendations.py が検索と再ランキングを1回だけ実行し、
+順位付きの候補IDを precomputed_recommendations テーブルに保存する。
+エージェントはライブ検索の前にこのテーブルを参照する。
+"""
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from app.utils.capture import captured
+
+
+# この値を超える天井高を「高天井」として扱う（m）
+HIGH_CEILING_THRESHOLD = 8
+# 天井高の区分（none: 未指定）
+CEILING_BANDS = ["none", "low", "high"]
+# テーブルが古い場合に読み込みを再試行する間隔（秒）
+PRECOMPUTED_RELOAD_INTERVAL = float(os.getenv("PRECOMPUTED_RELOAD_INTERVAL", "30"))
+
+RecommendationKey = Tuple[str, str, bool]
+
+
+def ceiling_band(ceiling_height: Optional[float]) -> str:
+    """天井高を区分に変換"""
+    if not ceiling_height:
+        return "none"
+    return "high" if ceiling_height > HIGH_CEILING_THRESHOLD else "low"
+
+
+def normalize_room_type(room_name: Optional[str]) -> str:
+    """部屋名を照合用に正規化"""
+    return (room_name or "").strip()
+
+
+def fetch_room_vocabulary(engine: Engine) -> List[str]:
+    """カタログの suitable_for に現れる部屋種別の一覧を取得"""
+    sql_query = text("""
+        SELECT DISTINCT jsonb_array_elements_text(suitable_for) AS room_type
+        FROM product_categories
+        ORDER BY room_type
+    """)
+    with engine.connect() as conn:
+        return [row[0] for row in conn.execute(sql_query).fetchall()]
+
+
+def fetch_catalog_version(engine: Engine) -> int:
+    """カタログ変更ログの最新versionを取得"""
+    with engine.connect() as conn:
+        result = conn.execute(
+            text('SELECT COALESCE(MAX("version"), 0) FROM product_category_changes')
+        )
+        return int(result.scalar() or 0)
+
+
+def save_recommendations(
+    engine: Engine,
+    rows: List[Dict[str, Any]],
+    catalog_version: int
+) -> None:
+    """
+    推薦テーブルを丸ごと置き換える（1トランザクション）
+
+    Args:
+        engine: SQLAlchemyエンジン
+        rows: room_type, ceiling_band, special_environment, query, candidate_ids を持つ辞書のリスト
+        catalog_version: 計算の基にしたカタログ変更version
+    """
+    insert_sql = text("""
+        INSERT INTO precomputed_recommendations (
+            room_type, ceiling_band, special_environment, query, candidate_ids, catalog_version
+        )
+        VALUES (
+            :room_type, :ceiling_band, :special_environment, :query, :candidate_ids, :catalog_version
+        )
+    """)
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM precomputed_recommendations"))
+        if rows:
+            conn.execute(insert_sql, [{**row, "catalog_version": catalog_version} for row in rows])
+
+
+class PrecomputedRecommendations:
+    """推薦テーブルのプロセス内コピー"""
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.catalog_version = -1
+        self._table: Dict[RecommendationKey, List[int]] = {}
+        self._loaded_at = 0.0
+
+    def load(self) -> None:
+        """テーブルを読み込む"""
+        sql_query = text("""
+            SELECT room_type, ceiling_band, special_environment, candidate_ids, catalog_version
+            FROM precomputed_recommendations
+        """)
+        with self.engine.connect() as conn:
+            rows = conn.execute(sql_query).fetchall()
+
+        self._table = {(row[0], row[1], bool(row[2])): list(row[3]) for row in rows}
+        self.catalog_version = min((int(row[4]) for row in rows), default=-1)
+
+    def is_current(self) -> bool:
+        """
+        計算以降にカタログが変更されていないか
+
+        変更フィードが正常でない場合はカタログのversionが分からないため、常に False とする
+        """
+        from app.utils.catalog_changes import get_catalog_change_feed
+
+        feed = get_catalog_change_feed()
+        return bool(self._table) and feed.healthy and self.catalog_version >= feed.version
+
+    def _refresh_if_needed(self) -> None:
+        if self.is_current():
+            return
+        now = time.monotonic()
+        if now - self._loaded_at < PRECOMPUTED_RELOAD_INTERVAL and self._loaded_at:
+            return
+        self._loaded_at = now
+        try:
+            self.load()
+        except Exception as e:
+            print(f"推薦テーブル読み込みエラー: {e}")
+
+    @captured("precomputed")
+    def lookup_ids(self, project_info: Any) -> Optional[List[int]]:
+        """物件情報に対応する候補IDを返す（該当なし・古い場合はNone）"""
+        self._refresh_if_needed()
+        if not self.is_current():
+            return None
+
+        key = (
+            normalize_room_type(project_info.room_name),
+            ceiling_band(project_info.ceiling_height),
+            bool(project_info.special_environment),
+        )
+        return self._table.get(key)
+
+    def lookup(self, project_info: Any) -> Optional[List[Dict[str, Any]]]:
+        """
+        物件情報に対応する候補機種を返す
+
+        Args:
+            project_info: 物件情報（ProjectInfo）
+
+        Returns:
+            順位順の候補機種リスト（該当なし・古い場合はNone）
+        """
+        ids = self.lookup_ids(project_info)
+        if not ids:
+            return None
+
+        from app.utils.search_categories import get_categories_by_ids
+
+        try:
+            categories_by_id = {category["id"]: category for category in get_categories_by_ids(ids)}
+        except Exception as e:
+            print(f"推薦候補の取得エラー: {e}")
+            return None
+        candidates = [categories_by_id[category_id] for category_id in ids if category_id in categories_by_id]
+        return candidates or None
+
+
+# グローバルなインスタンス
+_recommendations: Optional[PrecomputedRecommendations] = None
+
+
+def get_precomputed_recommendations() -> PrecomputedRecommendations:
+    """推薦テーブルを取得（シングルトン）"""
+    global _recommendations
+    if _recommendations is None:
+        from app.utils.search_categories import engine
+        _recommendations = PrecomputedRecommendations(engine)
+    return _recommendations
@@ -0,0 +1,257 @@
+"""/api/chat の応答キャッシュ
+
+初回のリクエストの多くは、同じ物件情報（部屋名・天井高・各フラグ）とほぼ同じ書き出しの
+メッセージで届く。物件情報を正規化したものと、最新メッセージ・会話履歴を正規化したもの
+（全角・半角、大文字・小文字、空白、末尾の句読点の違いを吸収）をキーにして応答全体を
+キャッシュし、LightingAgent の呼び出しを省略する。
+
+保存先は ResponseCacheBackend を実装すれば差し替えられる（既定はプロセス内のLRU + TTL）。
+カタログが変更された場合、行が追加・更新されたときは候補を含む全てのエントリを破棄する
+（候補外の行も変更後は候補に入りうるため）。行が削除されたときは、そのIDを候補に含むエントリだけを破棄する。
+"""
+import hashlib
+import json
+import os
+import re
+import time
+import unicodedata
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from app.models.chat import ChatResponse, Message, ProjectInfo
+from app.utils.capture import CAPTURE_PATH
+from app.utils.catalog_changes import CatalogChange, CatalogChangeFeed, get_catalog_change_feed
+
+
+# 応答キャッシュを使うか（既定は無効）
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+# エントリの有効期間（秒）
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "600"))
+# 保持する最大エントリ数
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s。、．，.,!?！？…~〜]+$")
+
+
+class ResponseCacheBackend(ABC):
+    """応答キャッシュの保存先のインターフェース"""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """有効なエントリを取得（ない場合・期限切れの場合はNone）"""
+
+    @abstractmethod
+    def set(self, key: str, entry: Dict[str, Any], ttl: float) -> None:
+        """エントリを保存"""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """エントリを削除"""
+
+    @abstractmethod
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """有効な全エントリ（無効化の判定に使う）"""
+
+    @abstractmethod
+    def clear(self) -> None:
+        """全エントリを削除"""
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """エントリ数"""
+
+
+class InMemoryLRUBackend(ResponseCacheBackend):
+    """プロセス内のLRU + TTLキャッシュ"""
+
+    def __init__(self, max_size: int = RESPONSE_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        expires_at, entry = item
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def set(self, key: str, entry: Dict[str, Any], ttl: float) -> None:
+        self._entries[key] = (time.monotonic() + ttl, entry)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        now = time.monotonic()
+        for key, (expires_at, entry) in list(self._entries.items()):
+            if expires_at > now:
+                yield key, entry
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def normalize_message(content: str) -> str:
+    """メッセージを照合用に正規化"""
+    normalized = unicodedata.normalize("NFKC", content or "").lower()
+    normalized = _WHITESPACE.sub(" ", normalized).strip()
+    return _TRAILING_PUNCTUATION.sub("", normalized)
+
+
+def canonical_project_info(context: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """物件情報を既定値を補った形に揃える（物件情報として解釈できない場合はそのまま）"""
+    if not context:
+        return None
+    try:
+        project_info = ProjectInfo(**context).model_dump()
+    except (TypeError, ValidationError):
+        return context
+    for key in ("property_name", "room_name", "impression"):
+        if project_info.get(key):
+            project_info[key] = normalize_message(project_info[key])
+    if project_info.get("manufacturers"):
+        project_info["manufacturers"] = sorted(project_info["manufacturers"])
+    return project_info
+
+
+def make_cache_key(messages: List[Message], context: Optional[Dict[str, Any]]) -> str:
+    """
+    正規化した物件情報と会話からキャッシュキーを計算
+
+    Args:
+        messages: 会話履歴（最新メッセージを含む）
+        context: 物件情報などのコンテキスト
+
+    Returns:
+        キャッシュキー
+    """
+    payload = json.dumps(
+        {
+            "project_info": canonical_project_info(context),
+            "messages": [[message.role, normalize_message(message.content)] for message in messages],
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """チャット応答全体のキャッシュ"""
+
+    def __init__(
+        self,
+        feed: CatalogChangeFeed,
+        backend: Optional[ResponseCacheBackend] = None,
+        ttl: float = RESPONSE_CACHE_TTL
+    ):
+        self.feed = feed
+        self.backend = backend or InMemoryLRUBackend()
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        feed.subscribe(self.on_catalog_change)
+
+    @property
+    def enabled(self) -> bool:
+        """
+        有効化されていて、変更フィードが正常（無効化が届いている）場合のみ使う
+
+        キャプチャ中は上流の応答を記録するためキャッシュしない
+        """
+        return RESPONSE_CACHE_ENABLED and self.feed.healthy and not CAPTURE_PATH
+
+    def get(self, key: str) -> Optional[ChatResponse]:
+        """キャッシュ済みの応答を取得（metadata.cache にヒットしたことを記録）"""
+        entry = self.backend.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+
+        response = ChatResponse(**entry["response"])
+        metadata = dict(response.metadata or {})
+        metadata["cache"] = {
+            "hit": True,
+            "age_seconds": round(time.time() - entry["stored_at"], 3),
+        }
+        return response.model_copy(update={"metadata": metadata})
+
+    def put(self, key: str, response: ChatResponse, generation: int) -> None:
+        """
+        応答をキャッシュに保存
+
+        Args:
+            key: キャッシュキー
+            response: エージェントの応答
+            generation: 応答生成前の変更フィードのgeneration（生成中に変更が届いていれば保存しない）
+        """
+        if generation != self.feed.generation:
+            return
+        candidate_ids = [
+            candidate["id"] for candidate in response.candidates or [] if candidate.get("id") is not None
+        ]
+        self.backend.set(
+            key,
+            {
+                "response": response.model_dump(),
+                "candidate_ids": candidate_ids,
+                "stored_at": time.time(),
+            },
+            self.ttl,
+        )
+
+    def on_catalog_change(self, change: CatalogChange) -> None:
+        """変更の影響を受けうるエントリを破棄する"""
+        if change.full_reload:
+            self.invalidated += len(self.backend)
+            self.backend.clear()
+            return
+
+        # 追加・更新された行は、候補外のものも含めて候補を含むどの応答の順位にも影響しうる
+        reranked = bool(change.inserted_ids or change.updated_ids)
+        for key, entry in list(self.backend.items()):
+            candidate_ids = entry.get("candidate_ids") or []
+            if not candidate_ids:
+                continue
+            if reranked or change.deleted_ids.intersection(candidate_ids):
+                self.backend.delete(key)
+                self.invalidated += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        """メトリクスを取得"""
+        return {
+            "enabled": self.enabled,
+            "size": len(self.backend),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidated": self.invalidated,
+        }
+
+
+# グローバルなキャッシュインスタンス
+_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> ResponseCache:
+    """応答キャッシュを取得（シングルトン）"""
+    global _cache
+    if _cache is None:
+        _cache = ResponseCache(get_catalog_change_feed())
+    return _cache
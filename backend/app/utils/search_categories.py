@@ -1,11 +1,18 @@
 """製品カテゴリ検索ロジック（Supabase + Embedding対応）"""
+import asyncio
+import heapq
 import json
+from collections import Counter
 from typing import List, Dict, Any, Optional
 from sqlalchemy import text, create_engine
 from sqlalchemy.orm import Session
 import os
 from dotenv import load_dotenv
 from app.utils.embeddings import get_embedding, prepare_text_for_embedding
+from app.utils.embedding_snapshot import get_embedding_snapshot
+from app.utils.capture import captured
+from app.utils.category_cache import get_category_cache
+from app.utils.keyword_index import get_keyword_index
 from langchain_openai import ChatOpenAI
 
 load_dotenv()
@@ -21,6 +28,11 @@ if "?schema=" in DATABASE_URL:
 
 engine = create_engine(DATABASE_URL)
 
+# LLM再ランキングの方式（text: 番号をカンマ区切りで回答 / structured: IDをJSONで回答）
+RERANK_MODE = os.getenv("RERANK_MODE", "text")
+# structured モードで渡す説明文の文字数
+RERANK_DESCRIPTION_CHARS = int(os.getenv("RERANK_DESCRIPTION_CHARS", "60"))
+
 
 async def search_categories_by_embedding(
     query: str,
@@ -44,19 +56,19 @@ async def search_categories_by_embedding(
     try:
         # クエリのベクトルを生成
         query_embedding = await get_embedding(query)
+
+        # カタログに追従しているスナップショットがあればDBでの類似度計算を省略
+        # （全行との内積はイベントループを止めないよう別スレッドで計算する。numpyは計算中GILを解放する）
+        matches = await asyncio.to_thread(_search_snapshot, query_embedding, limit)
+        if matches:
+            return _categories_with_similarity(matches)
+
         embedding_str = '[' + ','.join(map(str, query_embedding)) + ']'
 
-        # pgvectorで類似度検索
+        # pgvectorで類似度検索（IDと類似度のみ取得し、行はキャッシュから展開）
         sql_query = text(f"""
             SELECT
                 id,
-                name,
-                manufacturer,
-                series,
-                ceiling_height_min,
-                ceiling_height_max,
-                suitable_for,
-                description,
                 1 - (embedding <=> '{embedding_str}'::vector) as similarity
             FROM product_categories
             WHERE embedding IS NOT NULL
@@ -64,32 +76,342 @@ async def search_categories_by_embedding(
             LIMIT {limit}
         """)
 
-        with engine.connect() as conn:
-            result = conn.execute(sql_query)
-            rows = result.fetchall()
-
-            categories = []
-            for row in rows:
-                category = {
-                    "id": row[0],
-                    "name": row[1],
-                    "manufacturer": row[2],
-                    "series": row[3],
-                    "ceiling_height_min": float(row[4]) if row[4] else 0.0,
-                    "ceiling_height_max": float(row[5]) if row[5] else 0.0,
-                    "suitable_for": row[6] if isinstance(row[6], list) else json.loads(row[6]) if row[6] else [],
-                    "description": row[7],
-                    "similarity": float(row[8]) if row[8] else 0.0
-                }
-                categories.append(category)
-
-            return categories
+        rows = _fetch_rows(sql_query)
+        return _categories_with_similarity(
+            [(row[0], float(row[1]) if row[1] else 0.0) for row in rows]
+        )
 
     except Exception as e:
         print(f"Embedding検索エラー: {e}")
         return []
 
 
+@captured("db")
+def _fetch_rows(sql_query, params: Optional[Dict[str, Any]] = None) -> List[Any]:
+    """SQLを実行して全行を取得"""
+    with engine.connect() as conn:
+        return conn.execute(sql_query, params or {}).fetchall()
+
+
+@captured("snapshot")
+def _search_snapshot(query_embedding: List[float], limit: int) -> Optional[List[tuple]]:
+    """スナップショットで類似度検索（スナップショットがない・古い場合はNone）"""
+    snapshot = get_embedding_snapshot()
+    if snapshot is None or not _is_snapshot_current(snapshot):
+        return None
+    return snapshot.search(query_embedding, limit=limit)
+
+
+def _is_snapshot_current(snapshot) -> bool:
+    """
+    スナップショット書き出し以降にカタログが変更されていないか
+
+    変更フィードが正常でない（スクリプトなどから呼ばれた・ポーリングが失敗している）場合はカタログのversionが
+    分からないため、古い・別のDBのスナップショットを使わないよう常に False とする
+    """
+    from app.utils.catalog_changes import get_catalog_change_feed
+
+    feed = get_catalog_change_feed()
+    return feed.healthy and snapshot.catalog_version >= feed.version
+
+
+def _categories_with_similarity(matches: List[tuple]) -> List[Dict[str, Any]]:
+    """(ID, 類似度) のリストをカテゴリ情報に展開（順序を保持）"""
+    categories_by_id = {
+        category["id"]: category
+        for category in get_categories_by_ids([category_id for category_id, _ in matches])
+    }
+
+    categories = []
+    for category_id, similarity in matches:
+        category = categories_by_id.get(category_id)
+        if category is not None:  # 削除済みの行は除外
+            categories.append({**category, "similarity": similarity})
+    return categories
+
+
+def _row_to_category(row) -> Dict[str, Any]:
+    """SELECT結果の1行をカテゴリ辞書に変換"""
+    return {
+        "id": row[0],
+        "name": row[1],
+        "manufacturer": row[2],
+        "series": row[3],
+        "ceiling_height_min": float(row[4]) if row[4] else 0.0,
+        "ceiling_height_max": float(row[5]) if row[5] else 0.0,
+        "suitable_for": row[6] if isinstance(row[6], list) else json.loads(row[6]) if row[6] else [],
+        "description": row[7]
+    }
+
+
+@captured("db")
+def get_categories_by_ids(ids: List[int]) -> List[Dict[str, Any]]:
+    """
+    IDを指定して製品カテゴリを取得（カテゴリキャッシュを優先）
+
+    Args:
+        ids: カテゴリIDのリスト
+
+    Returns:
+        カテゴリのリスト（存在しないIDは含まれない、順序は不定）
+    """
+    if not ids:
+        return []
+
+    cache = get_category_cache()
+    cached, missing = cache.get_many(ids)
+    categories = [dict(category) for category in cached.values()]
+    if not missing:
+        return categories
+
+    generation = cache.feed.generation
+    fetched = _fetch_categories_by_ids(missing)
+    cache.put_many(fetched, generation)
+    categories.extend(dict(category) for category in fetched)
+    return categories
+
+
+def _fetch_categories_by_ids(ids: List[int]) -> List[Dict[str, Any]]:
+    """IDを指定してDBから製品カテゴリを取得"""
+    sql_query = text("""
+        SELECT
+            id,
+            name,
+            manufacturer,
+            series,
+            ceiling_height_min,
+            ceiling_height_max,
+            suitable_for,
+            description
+        FROM product_categories
+        WHERE id = ANY(:ids)
+    """)
+
+    rows = _fetch_rows(sql_query, {"ids": list(ids)})
+    return [_row_to_category(row) for row in rows]
+
+
+def fetch_all_categories() -> List[Dict[str, Any]]:
+    """全ての製品カテゴリをDBから取得（キーワードインデックスの構築用）"""
+    sql_query = text("""
+        SELECT
+            id,
+            name,
+            manufacturer,
+            series,
+            ceiling_height_min,
+            ceiling_height_max,
+            suitable_for,
+            description
+        FROM product_categories
+        ORDER BY id
+    """)
+
+    rows = _fetch_rows(sql_query, {})
+    return [_row_to_category(row) for row in rows]
+
+
+# メーカー一覧のキャッシュ（変更フィードが正常な間のみ使用し、カタログの変更で破棄する）
+_manufacturers: Optional[List[str]] = None
+_manufacturers_subscribed = False
+
+
+def _clear_manufacturers(change: Any) -> None:
+    global _manufacturers
+    _manufacturers = None
+
+
+@captured("db")
+def list_manufacturers() -> List[str]:
+    """
+    カタログに含まれるメーカーの一覧を取得
+
+    キャッシュから返した場合もキャプチャ・リプレイで記録・再生されるよう、関数ごと記録する
+    """
+    global _manufacturers, _manufacturers_subscribed
+    from app.utils.catalog_changes import get_catalog_change_feed
+
+    feed = get_catalog_change_feed()
+    if not _manufacturers_subscribed:
+        feed.subscribe(_clear_manufacturers)
+        _manufacturers_subscribed = True
+    if feed.healthy and _manufacturers is not None:
+        return list(_manufacturers)
+
+    generation = feed.generation
+    sql_query = text("""
+        SELECT DISTINCT manufacturer
+        FROM product_categories
+        ORDER BY manufacturer
+    """)
+    manufacturers = [row[0] for row in _fetch_rows(sql_query)]
+    # 取得中に変更が届いていなければキャッシュする
+    if feed.healthy and generation == feed.generation:
+        _manufacturers = manufacturers
+    return list(manufacturers)
+
+
+# パーティション検索で同時に実行するDBクエリ数の上限（全リクエスト合計、接続プールの枯渇を防ぐ）
+PARTITION_SEARCH_CONCURRENCY = int(os.getenv("PARTITION_SEARCH_CONCURRENCY", "4"))
+_partition_semaphore: Optional[asyncio.Semaphore] = None
+_partition_semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _get_partition_semaphore() -> asyncio.Semaphore:
+    """パーティション検索用のセマフォを取得（イベントループごとに作成）"""
+    global _partition_semaphore, _partition_semaphore_loop
+    loop = asyncio.get_running_loop()
+    if _partition_semaphore is None or _partition_semaphore_loop is not loop:
+        _partition_semaphore = asyncio.Semaphore(max(PARTITION_SEARCH_CONCURRENCY, 1))
+        _partition_semaphore_loop = loop
+    return _partition_semaphore
+
+
+async def _search_partition_bounded(embedding_str: str, manufacturer: str, limit: int) -> List[tuple]:
+    """同時実行数の上限内で1メーカー分のパーティションを検索"""
+    async with _get_partition_semaphore():
+        return await asyncio.to_thread(_search_partition, embedding_str, manufacturer, limit)
+
+
+def _search_partition(embedding_str: str, manufacturer: str, limit: int) -> List[tuple]:
+    """1メーカー分のパーティションで類似度の上位を取得"""
+    sql_query = text(f"""
+        SELECT
+            id,
+            1 - (embedding <=> '{embedding_str}'::vector) as similarity
+        FROM product_categories
+        WHERE embedding IS NOT NULL AND manufacturer = :manufacturer
+        ORDER BY embedding <=> '{embedding_str}'::vector
+        LIMIT {int(limit)}
+    """)
+    rows = _fetch_rows(sql_query, {"manufacturer": manufacturer})
+    return [(row[0], float(row[1]) if row[1] else 0.0) for row in rows]
+
+
+def merge_partition_results(
+    partition_results: Dict[str, List[tuple]],
+    limit: int,
+    min_per_partition: int = 0
+) -> List[tuple]:
+    """
+    パーティションごとの上位結果をマージする
+
+    各パーティションから min_per_partition 件を確保した上で、残りの枠を
+    類似度の高い順にヒープでマージして埋める。
+
+    Args:
+        partition_results: パーティション名 -> 類似度降順の (ID, 類似度) リスト
+        limit: 取得件数（確保分がこれを超える場合は確保分を優先）
+        min_per_partition: 各パーティションから確保する最低件数
+
+    Returns:
+        類似度降順の (ID, 類似度) リスト
+    """
+    guaranteed = []
+    rest = []
+    for results in partition_results.values():
+        guaranteed.extend(results[:min_per_partition])
+        rest.append(results[min_per_partition:])
+
+    remaining = max(limit - len(guaranteed), 0)
+    merged = heapq.merge(*rest, key=lambda match: -match[1])
+    selected = guaranteed + [match for _, match in zip(range(remaining), merged)]
+    return sorted(selected, key=lambda match: -match[1])
+
+
+async def search_categories_partitioned(
+    query: str,
+    manufacturers: Optional[List[str]] = None,
+    limit: int = 20,
+    min_per_manufacturer: int = 0
+) -> List[Dict[str, Any]]:
+    """
+    メーカー別にパーティション分割したEmbedding類似度検索
+
+    メーカーごとの上位を並行して取得し、ヒープでマージする。
+
+    Args:
+        query: 検索クエリ（自然言語）
+        manufacturers: 対象メーカー（Noneの場合は全メーカー）
+        limit: 取得件数
+        min_per_manufacturer: 各メーカーから確保する最低件数（相見積もりでの比較用）
+
+    Returns:
+        検索結果のカテゴリリスト（類似度降順）
+    """
+    try:
+        query_embedding = await get_embedding(query)
+        embedding_str = '[' + ','.join(map(str, query_embedding)) + ']'
+
+        partitions = manufacturers or await asyncio.to_thread(list_manufacturers)
+        per_partition_limit = max(limit, min_per_manufacturer)
+        results = await asyncio.gather(*[
+            _search_partition_bounded(embedding_str, manufacturer, per_partition_limit)
+            for manufacturer in partitions
+        ])
+
+        merged = merge_partition_results(
+            dict(zip(partitions, results)),
+            limit=limit,
+            min_per_partition=min_per_manufacturer
+        )
+        return _categories_with_similarity(merged)
+
+    except Exception as e:
+        print(f"パーティション検索エラー: {e}")
+        return []
+
+
+def enforce_manufacturer_quota(
+    ranked: List[Dict[str, Any]],
+    pool: List[Dict[str, Any]],
+    min_per_manufacturer: int,
+    limit: int
+) -> List[Dict[str, Any]]:
+    """
+    再ランキング後の候補に各メーカーの最低件数を確保する
+
+    不足しているメーカーの候補を pool の上位から補い、
+    最低件数を超えているメーカーの下位の候補と入れ替える。
+
+    Args:
+        ranked: 再ランキング済みの候補
+        pool: 再ランキング前の候補（類似度降順）
+        min_per_manufacturer: 各メーカーの最低件数
+        limit: 最大件数
+
+    Returns:
+        最低件数を満たすよう調整した候補リスト
+    """
+    result = list(ranked[:limit])
+    if min_per_manufacturer <= 0:
+        return result
+
+    counts = Counter(candidate.get("manufacturer") for candidate in result)
+    selected_ids = {candidate.get("id") for candidate in result}
+    for candidate in pool:
+        manufacturer = candidate.get("manufacturer")
+        if counts[manufacturer] >= min_per_manufacturer or candidate.get("id") in selected_ids:
+            continue
+
+        if len(result) >= limit:
+            # 最低件数を超えているメーカーの最下位の候補を外す
+            for i in range(len(result) - 1, -1, -1):
+                if counts[result[i].get("manufacturer")] > min_per_manufacturer:
+                    removed = result.pop(i)
+                    counts[removed.get("manufacturer")] -= 1
+                    selected_ids.discard(removed.get("id"))
+                    break
+            else:
+                continue
+
+        result.append(candidate)
+        counts[manufacturer] += 1
+        selected_ids.add(candidate.get("id"))
+
+    return result
+
+
 async def search_categories(
     query: Optional[str] = None,
     keywords: Optional[List[str]] = None,
@@ -137,12 +459,15 @@ async def search_categories(
     return []
 
 
+@captured("db")
 def search_categories_by_keywords(
     keywords: List[str],
     limit: int = 20
 ) -> List[Dict[str, Any]]:
     """
     キーワードで製品カテゴリを検索
+
+    転置インデックスとDBのどちらで検索した場合もキャプチャ・リプレイで記録・再生されるよう、関数ごと記録する
     
     Args:
         keywords: 検索キーワードのリスト
@@ -152,6 +477,11 @@ def search_categories_by_keywords(
         検索結果のカテゴリリスト
     """
     try:
+        # プロセス内の転置インデックスが使える場合はDBに問い合わせない
+        keyword_index = get_keyword_index()
+        if keyword_index.enabled:
+            return keyword_index.search(keywords, limit)
+
         if not keywords:
             # キーワードがない場合は全件取得
             sql_query = text("""
@@ -198,25 +528,8 @@ def search_categories_by_keywords(
                 LIMIT :limit
             """)
 
-        with engine.connect() as conn:
-            result = conn.execute(sql_query, params)
-            rows = result.fetchall()
-
-            categories = []
-            for row in rows:
-                category = {
-                    "id": row[0],
-                    "name": row[1],
-                    "manufacturer": row[2],
-                    "series": row[3],
-                    "ceiling_height_min": float(row[4]) if row[4] else 0.0,
-                    "ceiling_height_max": float(row[5]) if row[5] else 0.0,
-                    "suitable_for": row[6] if isinstance(row[6], list) else json.loads(row[6]) if row[6] else [],
-                    "description": row[7]
-                }
-                categories.append(category)
-
-            return categories
+        rows = _fetch_rows(sql_query, params)
+        return [_row_to_category(row) for row in rows]
 
     except Exception as e:
         print(f"キーワード検索エラー: {e}")
@@ -227,7 +540,9 @@ async def search_categories_by_text(
     query: str,
     categories: List[Dict[str, Any]],
     llm: ChatOpenAI,
-    max_results: int = 10
+    max_results: int = 10,
+    mode: Optional[str] = None,
+    usage: Optional[Dict[str, Any]] = None
 ) -> List[Dict[str, Any]]:
     """
     LLMを使用してカテゴリリストを再ランキング/フィルタリング
@@ -237,6 +552,9 @@ async def search_categories_by_text(
         categories: 候補カテゴリのリスト
         llm: Langchain LLMインスタンス
         max_results: 最大結果数
+        mode: "text"（番号をカンマ区切りで回答）または "structured"（IDをJSONで回答）。
+              Noneの場合は RERANK_MODE
+        usage: 指定した場合、モードとトークン数を書き込む
     
     Returns:
         再ランキングされたカテゴリリスト
@@ -246,6 +564,10 @@ async def search_categories_by_text(
     
     if len(categories) <= max_results:
         return categories
+
+    mode = mode or RERANK_MODE
+    if mode == "structured":
+        return await _rerank_structured(query, categories, llm, max_results, usage)
     
     # カテゴリ情報をテキストに変換
     categories_text = ""
@@ -286,41 +608,103 @@ async def search_categories_by_text(
             HumanMessage(content=prompt)
         ]
         response = await llm.ainvoke(messages)
+        _record_token_usage(usage, "text", response)
         
         # 回答から番号を抽出
         response_text = response.content.strip()
-        selected_indices = []
+        selected = []
         
         for part in response_text.split(','):
             part = part.strip()
             if part.isdigit():
                 idx = int(part) - 1  # 1-indexedから0-indexedに変換
                 if 0 <= idx < len(categories):
-                    selected_indices.append(idx)
-        
-        # 重複を除去し、順序を保持
-        seen = set()
-        result = []
-        for idx in selected_indices:
-            if idx not in seen:
-                seen.add(idx)
-                result.append(categories[idx])
-                if len(result) >= max_results:
-                    break
+                    selected.append(categories[idx])
         
-        # もし選定数が足りない場合は、最初のカテゴリを追加
-        while len(result) < max_results and len(result) < len(categories):
-            for cat in categories:
-                if cat not in result:
-                    result.append(cat)
-                    break
-            else:
-                break
-        
-        return result[:max_results]
+        return _fill_results(selected, categories, max_results)
         
     except Exception as e:
         print(f"LLM再ランキングエラー: {e}")
         # エラー時は最初のmax_results件を返す
         return categories[:max_results]
 
+
+async def _rerank_structured(
+    query: str,
+    categories: List[Dict[str, Any]],
+    llm: ChatOpenAI,
+    max_results: int,
+    usage: Optional[Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    """IDと主要な属性だけを渡し、選定したIDをJSONで受け取る再ランキング"""
+    from langchain_core.messages import HumanMessage, SystemMessage
+
+    # 1候補1行の区切り形式（説明は先頭のみ）
+    lines = ["id|名称|メーカー|用途|説明"]
+    for cat in categories[:50]:  # 最大50件までLLMに渡す
+        suitable = "/".join(cat.get("suitable_for") or [])
+        desc = (cat.get("description") or "")[:RERANK_DESCRIPTION_CHARS].replace("\n", " ")
+        lines.append(f"{cat.get('id')}|{cat.get('name', '')}|{cat.get('manufacturer') or ''}|{suitable}|{desc}")
+    categories_text = "\n".join(lines)
+
+    prompt = f"""クエリ「{query}」に最も適した照明器具カテゴリを重要度の高い順に最大{max_results}件選び、
+{{"ids": [id, ...]}} の形式のJSONで回答してください。
+
+{categories_text}
+"""
+
+    try:
+        messages = [
+            SystemMessage(content="あなたは照明器具選定の専門家です。JSONのみで回答してください。"),
+            HumanMessage(content=prompt)
+        ]
+        response = await llm.bind(response_format={"type": "json_object"}).ainvoke(messages)
+        _record_token_usage(usage, "structured", response)
+
+        categories_by_id = {cat.get("id"): cat for cat in categories}
+        selected_ids = json.loads(response.content).get("ids", [])
+        selected = []
+        for value in selected_ids:
+            # モデルがIDを文字列（"12"）で返す場合があるため整数に揃える
+            try:
+                category_id = int(value)
+            except (TypeError, ValueError):
+                continue
+            if category_id in categories_by_id:
+                selected.append(categories_by_id[category_id])
+        return _fill_results(selected, categories, max_results)
+
+    except Exception as e:
+        print(f"LLM再ランキングエラー: {e}")
+        # エラー時は最初のmax_results件を返す
+        return categories[:max_results]
+
+
+def _fill_results(
+    selected: List[Dict[str, Any]],
+    categories: List[Dict[str, Any]],
+    max_results: int
+) -> List[Dict[str, Any]]:
+    """重複を除去し、選定数が足りない場合は元の順序で補う（IDの集合で判定）"""
+    result = []
+    seen_ids = set()
+    for cat in selected + categories:
+        if len(result) >= max_results:
+            break
+        if cat.get("id") in seen_ids:
+            continue
+        seen_ids.add(cat.get("id"))
+        result.append(cat)
+    return result
+
+
+def _record_token_usage(usage: Optional[Dict[str, Any]], mode: str, response: Any) -> None:
+    """LLM応答のトークン数を usage に書き込む"""
+    if usage is None:
+        return
+    token_usage = (getattr(response, "response_metadata", None) or {}).get("token_usage") or {}
+    usage_metadata = getattr(response, "usage_metadata", None) or {}
+    usage["mode"] = mode
+    usage["prompt_tokens"] = token_usage.get("prompt_tokens", usage_metadata.get("input_tokens"))
+    usage["completion_tokens"] = token_usage.get("completion_tokens", usage_metadata.get("output_tokens"))
+
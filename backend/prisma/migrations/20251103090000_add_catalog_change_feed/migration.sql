@@ -0,0 +1,32 @@
+-- CreateTable
+CREATE TABLE "product_category_changes" (
+    "version" BIGSERIAL NOT NULL,
+    "category_id" INTEGER NOT NULL,
+    "op" VARCHAR(10) NOT NULL,
+    "changed_at" TIMESTAMPTZ NOT NULL DEFAULT now(),
+
+    CONSTRAINT "product_category_changes_pkey" PRIMARY KEY ("version")
+);
+
+-- product_categories の変更を変更ログに記録するトリガー
+-- バックエンドは version を差分ポーリングしてキャッシュ・インデックスを更新する
+CREATE OR REPLACE FUNCTION record_product_category_change() RETURNS trigger AS $$
+BEGIN
+    IF (TG_OP = 'DELETE') THEN
+        INSERT INTO "product_category_changes" ("category_id", "op") VALUES (OLD."id", TG_OP);
+        RETURN OLD;
+    END IF;
+
+    -- 内容が変わらないUPDATEは記録しない
+    IF (TG_OP = 'UPDATE' AND OLD IS NOT DISTINCT FROM NEW) THEN
+        RETURN NEW;
+    END IF;
+
+    INSERT INTO "product_category_changes" ("category_id", "op") VALUES (NEW."id", TG_OP);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER "product_categories_change_log"
+    AFTER INSERT OR UPDATE OR DELETE ON "product_categories"
+    FOR EACH ROW EXECUTE FUNCTION record_product_category_change();
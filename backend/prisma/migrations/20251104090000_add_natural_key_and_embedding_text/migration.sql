@@ -0,0 +1,6 @@
+-- AlterTable
+ALTER TABLE "product_categories" ADD COLUMN "embedding_text" TEXT;
+
+-- CreateIndex
+-- 取り込み時のupsertに使う自然キー
+CREATE UNIQUE INDEX "product_categories_manufacturer_name_key" ON "product_categories"("manufacturer", "name");
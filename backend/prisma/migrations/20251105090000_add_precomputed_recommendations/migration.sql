@@ -0,0 +1,12 @@
+-- CreateTable
+CREATE TABLE "precomputed_recommendations" (
+    "room_type" VARCHAR(255) NOT NULL,
+    "ceiling_band" VARCHAR(10) NOT NULL,
+    "special_environment" BOOLEAN NOT NULL,
+    "query" TEXT NOT NULL,
+    "candidate_ids" INTEGER[] NOT NULL,
+    "catalog_version" BIGINT NOT NULL,
+    "created_at" TIMESTAMPTZ NOT NULL DEFAULT now(),
+
+    CONSTRAINT "precomputed_recommendations_pkey" PRIMARY KEY ("room_type", "ceiling_band", "special_environment")
+);
@@ -0,0 +1,11 @@
+-- 変更ログに書き込んだトランザクションIDを記録する
+-- version（BIGSERIAL）は採番順でありコミット順ではないため、長いトランザクションの変更が
+-- 後からコミットされても取りこぼさないよう、バックエンドはスナップショットのxminを基準にポーリングする
+ALTER TABLE "product_category_changes"
+    ADD COLUMN "xact_id" xid8 NOT NULL DEFAULT pg_current_xact_id();
+
+-- CreateIndex
+CREATE INDEX "product_category_changes_xact_id_idx" ON "product_category_changes"("xact_id");
+
+-- CreateIndex（古い変更ログの削除用）
+CREATE INDEX "product_category_changes_changed_at_idx" ON "product_category_changes"("changed_at");
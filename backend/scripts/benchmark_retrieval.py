@@ -0,0 +1,414 @@
+"""製品カテゴリ検索のマイクロベンチマーク
+
+product_categories.json と同じ形の合成カタログ（1k / 10k / 100k件）をベンチマーク用DBに投入し、
+app/utils/search_categories.py の各検索経路について以下を計測してJSONに保存する。
+
+- レイテンシ（ミリ秒、min / p50 / p95 / mean / max）
+- メモリ割り当て（tracemallocによるピーク・ブロック数）
+- スキャン行数（実行されたSQLを EXPLAIN ANALYZE して集計）
+
+OpenAI APIは呼ばず、クエリと行IDから決定的に生成したベクトルとダミーLLMを使うため、
+同じDB環境であればコミット間で結果を比較できる。
+
+注意: ベンチマーク用DBの product_categories は合成データで置き換えられる。
+必ず本番とは別のDB（マイグレーション適用済み）を BENCHMARK_DATABASE_URL に指定すること。
+
+使い方:
+    BENCHMARK_DATABASE_URL=postgresql://... python scripts/benchmark_retrieval.py
+    python scripts/benchmark_retrieval.py --sizes 1000 10000 --iterations 20
+    python scripts/benchmark_retrieval.py --compare benchmark_results/retrieval_abc1234.json
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List
+
+
+# backendディレクトリをPythonパスに追加
+CURRENT_DIR = Path(__file__).resolve().parent
+BACKEND_ROOT = CURRENT_DIR.parent
+if str(BACKEND_ROOT) not in sys.path:
+    sys.path.append(str(BACKEND_ROOT))
+
+
+if sys.platform.startswith("win"):
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+DEFAULT_ITERATIONS = 10
+DEFAULT_SEED = 42
+EMBEDDING_DIMENSIONS = 1536
+SOURCE_CATALOG = BACKEND_ROOT / "app" / "data" / "product_categories.json"
+RESULTS_DIR = BACKEND_ROOT / "benchmark_results"
+
+# 実運用で多いクエリの形（_generate_search_response と同じ組み立て方）
+BENCHMARK_QUERIES = [
+    ("オフィス に適した照明器具", ["オフィス", "低天井"]),
+    ("会議室 に適した照明器具", ["会議室", "低天井"]),
+    ("倉庫 高天井に適した照明器具", ["倉庫", "高天井"]),
+    ("厨房 特殊環境に適した照明器具", ["厨房", "特殊環境", "厨房"]),
+    ("クリーンルーム 特殊環境に適した照明器具", ["クリーンルーム", "特殊環境", "クリーンルーム"]),
+]
+SYNTHETIC_MANUFACTURERS = ["三菱電機", "パナソニック", "東芝ライテック", "岩崎電気", "遠藤照明", "オーデリック"]
+SCAN_NODE_TYPES = {"Seq Scan", "Index Scan", "Index Only Scan", "Bitmap Heap Scan"}
+
+# 行IDから決定的なベクトルを生成するSQL（クエリ側は fake_embedding と同じ式）
+FILL_EMBEDDINGS_SQL = f"""
+    UPDATE product_categories SET embedding = (
+        SELECT array_agg(sin(product_categories.id * 0.7071 + g * 0.1373) ORDER BY g)::vector
+        FROM generate_series(1, {EMBEDDING_DIMENSIONS}) AS g
+    )
+"""
+
+
+def configure_database_url() -> str:
+    """ベンチマーク用DBのURLをDATABASE_URLに設定する（app.utilsのimportより前に呼ぶ）"""
+    from dotenv import load_dotenv
+
+    load_dotenv(dotenv_path=BACKEND_ROOT / ".env")
+    database_url = os.getenv("BENCHMARK_DATABASE_URL")
+    if not database_url:
+        raise ValueError("BENCHMARK_DATABASE_URL が設定されていません（本番DBは使用できません）")
+    if database_url == os.getenv("DATABASE_URL"):
+        raise ValueError("BENCHMARK_DATABASE_URL には DATABASE_URL と別のDBを指定してください")
+
+    os.environ["DATABASE_URL"] = database_url
+    return database_url
+
+
+def generate_synthetic_catalog(size: int, seed: int) -> List[Dict[str, Any]]:
+    """product_categories.json と同じ形の合成カタログを生成する"""
+    with SOURCE_CATALOG.open("r", encoding="utf-8") as f:
+        source = json.load(f)
+
+    rng = random.Random(seed)
+    vocabulary = sorted({item for category in source for item in category.get("suitable_for", [])})
+    vocabulary += [query[1][0] for query in BENCHMARK_QUERIES]
+    sentences = [
+        sentence + "。"
+        for category in source
+        for sentence in (category.get("description") or "").split("。")
+        if sentence
+    ]
+
+    catalog = []
+    for i in range(size):
+        base = source[i % len(source)]
+        ceiling_min = rng.choice([2.2, 2.5, 2.7, 3.0, 4.0, 6.0])
+        catalog.append({
+            "name": f"{base['name']} SYN-{i:06d}",
+            "manufacturer": rng.choice(SYNTHETIC_MANUFACTURERS),
+            "series": f"{base['series']} {i % 97:02d}",
+            "ceiling_height_min": ceiling_min,
+            "ceiling_height_max": ceiling_min + rng.choice([1.5, 2.0, 4.0, 10.0]),
+            "suitable_for": rng.sample(vocabulary, rng.randint(2, 6)),
+            "description": "".join(rng.sample(sentences, rng.randint(2, 4))),
+        })
+    return catalog
+
+
+def load_synthetic_catalog(size: int, seed: int) -> None:
+    """合成カタログをベンチマーク用DBに投入し、決定的なembeddingを設定する"""
+    from sqlalchemy import text
+    from app.utils.search_categories import engine
+    from scripts.ingest_product_categories import ingest
+
+    catalog = generate_synthetic_catalog(size, seed)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / "catalog.jsonl"
+        with path.open("w", encoding="utf-8") as f:
+            for category in catalog:
+                f.write(json.dumps(category, ensure_ascii=False) + "\n")
+        ingest(path, replace=True)
+
+    with engine.begin() as conn:
+        conn.execute(text(FILL_EMBEDDINGS_SQL))
+        conn.execute(text("ANALYZE product_categories"))
+
+
+async def fake_embedding(
+    text: str,
+    model: str = "text-embedding-3-small",
+    dimensions: int = EMBEDDING_DIMENSIONS
+) -> List[float]:
+    """クエリから決定的なベクトルを生成する（OpenAI APIの代わり）"""
+    seed = int(hashlib.sha256(text.encode("utf-8")).hexdigest(), 16) % 100_000
+    return [math.sin(seed * 0.7071 + g * 0.1373) for g in range(1, dimensions + 1)]
+
+
+class FakeRerankLLM:
+    """決まった番号を返すダミーLLM（件数不足時の補完処理も通るよう3件だけ返す）"""
+
+    class _Response:
+        def __init__(self, content: str):
+            self.content = content
+
+    def __init__(self, structured: bool = False):
+        self.structured = structured
+
+    def bind(self, **kwargs: Any) -> "FakeRerankLLM":
+        # response_format を指定された場合は structured モードとしてJSONで回答する
+        return FakeRerankLLM(structured="response_format" in kwargs)
+
+    async def ainvoke(self, messages: List[Any]) -> "FakeRerankLLM._Response":
+        if not self.structured:
+            return self._Response("1, 4, 2")
+        ids = [line.split("|", 1)[0] for line in messages[-1].content.splitlines() if line[:1].isdigit()]
+        return self._Response(json.dumps({"ids": [int(ids[i]) for i in (0, 3, 1) if i < len(ids)]}))
+
+
+class StatementRecorder:
+    """計測対象の呼び出し中に実行されたSQLを記録する"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements: List[tuple] = []
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if not statement.lstrip().upper().startswith("EXPLAIN"):
+            self.statements.append((statement, parameters))
+
+    def __enter__(self) -> "StatementRecorder":
+        from sqlalchemy import event
+
+        event.listen(self.engine, "before_cursor_execute", self._before_execute)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        from sqlalchemy import event
+
+        event.remove(self.engine, "before_cursor_execute", self._before_execute)
+
+
+def _count_scanned_rows(plan: Dict[str, Any]) -> int:
+    """EXPLAIN ANALYZE の計画木からスキャンノードの読み取り行数を合計する"""
+    total = 0
+    if plan.get("Node Type") in SCAN_NODE_TYPES:
+        loops = plan.get("Actual Loops", 1)
+        total += (plan.get("Actual Rows", 0) + plan.get("Rows Removed by Filter", 0)) * loops
+    for child in plan.get("Plans", []):
+        total += _count_scanned_rows(child)
+    return total
+
+
+def measure_rows_scanned(engine, statements: List[tuple]) -> int:
+    """記録したSQLを EXPLAIN ANALYZE で再実行し、スキャン行数を返す"""
+    total = 0
+    raw_conn = engine.raw_connection()
+    try:
+        cursor = raw_conn.cursor()
+        for statement, parameters in statements:
+            cursor.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + statement, parameters)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            total += _count_scanned_rows(plan[0]["Plan"])
+        raw_conn.rollback()
+    finally:
+        raw_conn.close()
+    return total
+
+
+async def call_sync(func: Callable[..., Any], *args: Any) -> Any:
+    """同期関数を（スレッドを介さずに）計測ループから呼び出す"""
+    return func(*args)
+
+
+def _summarize_latencies(latencies: List[float]) -> Dict[str, float]:
+    ordered = sorted(latencies)
+    return {
+        "min": round(ordered[0], 3),
+        "p50": round(statistics.median(ordered), 3),
+        "p95": round(ordered[min(len(ordered) - 1, math.ceil(len(ordered) * 0.95) - 1)], 3),
+        "mean": round(statistics.fmean(ordered), 3),
+        "max": round(ordered[-1], 3),
+    }
+
+
+async def run_benchmark(
+    name: str,
+    func: Callable[[], Awaitable[Any]],
+    engine,
+    iterations: int
+) -> Dict[str, Any]:
+    """1つの検索経路をウォームアップ後に計測する"""
+    await func()  # ウォームアップ（接続確立など）
+
+    latencies = []
+    result_count = 0
+    for _ in range(iterations):
+        start = time.perf_counter()
+        result = await func()
+        latencies.append((time.perf_counter() - start) * 1000)
+        result_count = len(result)
+
+    # 割り当ては計測オーバーヘッドがあるため別パスで計測する
+    tracemalloc.start()
+    with StatementRecorder(engine) as recorder:
+        await func()
+    current, peak = tracemalloc.get_traced_memory()
+    blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+    tracemalloc.stop()
+
+    return {
+        "benchmark": name,
+        "iterations": iterations,
+        "result_count": result_count,
+        "latency_ms": _summarize_latencies(latencies),
+        "allocations": {
+            "peak_kib": round(peak / 1024, 1),
+            "retained_kib": round(current / 1024, 1),
+            "retained_blocks": blocks,
+        },
+        "sql_statements": len(recorder.statements),
+        "rows_scanned": measure_rows_scanned(engine, recorder.statements),
+    }
+
+
+async def benchmark_size(size: int, iterations: int, seed: int, rerank_pools: List[int]) -> List[Dict[str, Any]]:
+    """1つのカタログサイズについて全ての検索経路を計測する"""
+    from app.utils import search_categories as sc
+    from app.utils.catalog_changes import CatalogChangeFeed
+    from app.utils.keyword_index import KeywordIndex
+
+    print(f"[INFO] 合成カタログ {size}件を投入しています")
+    load_synthetic_catalog(size, seed)
+
+    # プロセス内の転置インデックス（フィードは動かさないため、DB経路の計測には影響しない）
+    keyword_index = KeywordIndex(CatalogChangeFeed(sc.engine))
+    keyword_index.build(sc.fetch_all_categories())
+
+    llm = FakeRerankLLM()
+    results = []
+    for query, keywords in BENCHMARK_QUERIES:
+        benchmarks = {
+            "search_categories_by_embedding": lambda: sc.search_categories_by_embedding(query, limit=20),
+            "search_categories_by_keywords": lambda: call_sync(sc.search_categories_by_keywords, keywords, 20),
+            "keyword_index.search": lambda: call_sync(keyword_index.search, keywords, 20),
+            "search_categories_hybrid": lambda: sc.search_categories(query=query, keywords=keywords, use_embedding=True),
+        }
+        for pool_size in rerank_pools:
+            pool = sc.search_categories_by_keywords([], limit=pool_size)
+            for mode in ("text", "structured"):
+                # text モードは以前の結果と比較できるよう従来の名前のままにする
+                suffix = "" if mode == "text" else f",mode={mode}"
+                benchmarks[f"search_categories_by_text[pool={pool_size}{suffix}]"] = (
+                    lambda pool=pool, mode=mode: sc.search_categories_by_text(
+                        query, pool, llm=llm, max_results=10, mode=mode
+                    )
+                )
+
+        for name, func in benchmarks.items():
+            result = await run_benchmark(name, func, sc.engine, iterations)
+            result.update({"catalog_size": size, "query": query})
+            results.append(result)
+            print(
+                f"[DONE] size={size} {name} query={query} "
+                f"p50={result['latency_ms']['p50']}ms rows_scanned={result['rows_scanned']}"
+            )
+    return results
+
+
+def git_commit() -> str:
+    """現在のコミットID（取得できない場合は unknown）"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_ROOT, text=True
+        ).strip()
+    except Exception:
+        return "unknown"
+
+
+def compare_results(base_path: Path, current: Dict[str, Any]) -> None:
+    """保存済みの結果と p50 レイテンシ・スキャン行数を比較して表示する"""
+    with base_path.open("r", encoding="utf-8") as f:
+        base = json.load(f)
+
+    def key(result: Dict[str, Any]) -> tuple:
+        return (result["catalog_size"], result["benchmark"], result["query"])
+
+    base_results = {key(result): result for result in base["results"]}
+    print(f"\n比較: {base['meta']['git_commit']} -> {current['meta']['git_commit']}")
+    unmatched = []
+    for result in current["results"]:
+        previous = base_results.pop(key(result), None)
+        if not previous:
+            unmatched.append(result)
+            continue
+        before = previous["latency_ms"]["p50"]
+        after = result["latency_ms"]["p50"]
+        ratio = after / before if before else float("inf")
+        print(
+            f"  size={result['catalog_size']:>6} {result['benchmark']:<45} "
+            f"p50 {before:>9.3f} -> {after:>9.3f}ms ({ratio:5.2f}x) "
+            f"rows {previous['rows_scanned']} -> {result['rows_scanned']}"
+        )
+
+    # 片方にしかない計測（追加・改名されたベンチマークなど）は比較できないことを明示する
+    for result in unmatched:
+        print(f"  [WARN] 比較対象なし（今回のみ）: size={result['catalog_size']} {result['benchmark']} query={result['query']}")
+    for result in base_results.values():
+        print(f"  [WARN] 比較対象なし（前回のみ）: size={result['catalog_size']} {result['benchmark']} query={result['query']}")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="製品カテゴリ検索のマイクロベンチマーク")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="合成カタログの件数")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS, help="計測の繰り返し回数")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="合成カタログの乱数シード")
+    parser.add_argument("--rerank-pools", type=int, nargs="+", default=[20, 50], help="再ランキングに渡す候補数")
+    parser.add_argument("--output", type=Path, help="結果JSONの出力先")
+    parser.add_argument("--compare", type=Path, help="比較対象の結果JSON")
+    args = parser.parse_args()
+
+    configure_database_url()
+
+    # OpenAI APIを呼ばないよう決定的なembeddingに差し替える
+    from app.utils import search_categories as sc
+    sc.get_embedding = fake_embedding
+
+    results = []
+    for size in args.sizes:
+        results.extend(await benchmark_size(size, args.iterations, args.seed, args.rerank_pools))
+
+    commit = git_commit()
+    report = {
+        "meta": {
+            "git_commit": commit,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sizes": args.sizes,
+            "iterations": args.iterations,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+    output = args.output or RESULTS_DIR / f"retrieval_{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with output.open("w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"[INFO] 結果を保存しました: {output}")
+
+    if args.compare:
+        compare_results(args.compare, report)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,6 +1,8 @@
 """product_categories テーブルのembeddingカラムを生成・更新するスクリプト"""
 
+import argparse
 import asyncio
+import json
 import os
 import sys
 from pathlib import Path
@@ -17,6 +19,10 @@ if str(BACKEND_ROOT) not in sys.path:
     sys.path.append(str(BACKEND_ROOT))
 
 from app.utils.embeddings import get_embedding, prepare_text_for_embedding_from_dict  # noqa: E402
+from app.utils.embedding_snapshot import EMBEDDING_SNAPSHOT_PATH, write_snapshot  # noqa: E402
+
+
+EMBEDDING_DIMENSIONS = 1536
 
 
 if sys.platform.startswith("win"):
@@ -37,10 +43,11 @@ def load_database_url() -> str:
     return database_url
 
 
-def fetch_categories(engine) -> list[Dict[str, Any]]:
-    """product_categories のレコードを取得する"""
+def fetch_categories(engine, only_missing: bool = False) -> list[Dict[str, Any]]:
+    """product_categories のレコードを取得する（only_missing=Trueの場合はembedding未生成の行のみ）"""
+    where_clause = "WHERE embedding IS NULL" if only_missing else ""
     select_sql = text(
-        """
+        f"""
         SELECT
             id,
             name,
@@ -49,8 +56,10 @@ def fetch_categories(engine) -> list[Dict[str, Any]]:
             ceiling_height_min,
             ceiling_height_max,
             suitable_for,
-            description
+            description,
+            embedding_text
         FROM product_categories
+        {where_clause}
         ORDER BY id
         """
     )
@@ -60,12 +69,13 @@ def fetch_categories(engine) -> list[Dict[str, Any]]:
         return [dict(row) for row in result.mappings().all()]
 
 
-def update_embedding(engine, category_id: int, embedding_str: str) -> None:
-    """embeddingカラムを更新する"""
+def update_embedding(engine, category_id: int, embedding_str: str, embedding_text: str) -> None:
+    """embeddingカラムと、その元になったテキスト（embedding_text）を更新する"""
     update_sql = text(
         """
         UPDATE product_categories
-        SET embedding = CAST(:embedding AS vector)
+        SET embedding = CAST(:embedding AS vector),
+            embedding_text = :embedding_text
         WHERE id = :category_id
         """
     )
@@ -73,16 +83,43 @@ def update_embedding(engine, category_id: int, embedding_str: str) -> None:
     with engine.begin() as conn:
         conn.execute(
             update_sql,
-            {"embedding": embedding_str, "category_id": category_id},
+            {"embedding": embedding_str, "embedding_text": embedding_text, "category_id": category_id},
         )
 
 
-async def generate_embeddings() -> None:
-    """全カテゴリのembeddingを生成して保存する"""
+def export_snapshot(engine, path: Path = EMBEDDING_SNAPSHOT_PATH) -> int:
+    """embeddingをmmap用のスナップショットとして書き出す（既存ファイルはアトミックに置き換え）"""
+    with engine.connect() as conn:
+        # 件数・行・カタログ変更versionを同じ時点のデータから読む
+        conn = conn.execution_options(isolation_level="REPEATABLE READ", stream_results=True)
+        with conn.begin():
+            catalog_version = conn.execute(
+                text('SELECT COALESCE(MAX("version"), 0) FROM product_category_changes')
+            ).scalar()
+            count = conn.execute(
+                text("SELECT COUNT(*) FROM product_categories WHERE embedding IS NOT NULL")
+            ).scalar()
+            result = conn.execute(
+                text(
+                    """
+                    SELECT id, embedding::text
+                    FROM product_categories
+                    WHERE embedding IS NOT NULL
+                    ORDER BY id
+                    """
+                )
+            )
+            # pgvectorのテキスト表現 "[0.1,0.2,...]" はJSON配列として読める
+            rows = ((row[0], json.loads(row[1])) for row in result)
+            return write_snapshot(path, rows, int(count), EMBEDDING_DIMENSIONS, int(catalog_version))
+
+
+async def generate_embeddings(only_missing: bool = False) -> None:
+    """全カテゴリ（only_missing=Trueの場合は未生成のカテゴリ）のembeddingを生成して保存する"""
     database_url = load_database_url()
     engine = create_engine(database_url)
 
-    categories = fetch_categories(engine)
+    categories = fetch_categories(engine, only_missing=only_missing)
     if not categories:
         print("📭 登録済みのカテゴリがありません")
         return
@@ -91,7 +128,8 @@ async def generate_embeddings() -> None:
     print(f"[INFO] embedding生成を開始します（対象: {total}件）")
 
     for index, category in enumerate(categories, start=1):
-        text_for_embedding = prepare_text_for_embedding_from_dict(category)
+        # 取り込み時に計算済みのテキストがあればそれを使う（シードなどで未設定の行はここで計算）
+        text_for_embedding = category.get("embedding_text") or prepare_text_for_embedding_from_dict(category)
         if not text_for_embedding.strip():
             print(f"[WARN] テキストが空のためスキップ: {category['name']}")
             continue
@@ -103,14 +141,30 @@ async def generate_embeddings() -> None:
             continue
 
         embedding_str = "[" + ",".join(f"{value:.10f}" for value in embedding) + "]"
-        update_embedding(engine, category["id"], embedding_str)
+        update_embedding(engine, category["id"], embedding_str, text_for_embedding)
 
         print(f"[DONE] {index}/{total} {category['name']} のembeddingを更新しました")
 
     print("[INFO] 全てのembedding生成が完了しました")
 
 
+def run_export_snapshot() -> None:
+    """スナップショットを書き出してログを出力する"""
+    engine = create_engine(load_database_url())
+    written = export_snapshot(engine)
+    print(f"[DONE] スナップショットを書き出しました（{written}件）: {EMBEDDING_SNAPSHOT_PATH}")
+
+
 if __name__ == "__main__":
-    asyncio.run(generate_embeddings())
+    parser = argparse.ArgumentParser(description="product_categories のembeddingを生成します")
+    parser.add_argument("--only-missing", action="store_true", help="embeddingが未生成の行のみ処理する")
+    parser.add_argument("--snapshot-only", action="store_true", help="embeddingは生成せずスナップショットのみ書き出す")
+    parser.add_argument("--no-snapshot", action="store_true", help="スナップショットを書き出さない")
+    args = parser.parse_args()
+
+    if not args.snapshot_only:
+        asyncio.run(generate_embeddings(only_missing=args.only_missing))
+    if not args.no_snapshot:
+        run_export_snapshot()
 
 
@@ -0,0 +1,388 @@
+"""大規模なメーカーカタログを product_categories にストリーミング投入するスクリプト
+
+JSON（配列）/ JSONL / CSV をレコード単位で読み込みながら embedding 用テキストを計算し、
+COPY で一時ステージングテーブルへ流し込む。最後に自然キー（manufacturer, name）で
+upsert し、1トランザクションでコミットするため、投入中も本番テーブルは空にならない。
+
+使い方:
+    python scripts/ingest_product_categories.py app/data/product_categories.json
+    python scripts/ingest_product_categories.py catalog.jsonl --replace
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+from itertools import islice
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from dotenv import load_dotenv
+from psycopg2.extras import execute_batch
+from sqlalchemy import create_engine
+
+
+# backendディレクトリをPythonパスに追加
+CURRENT_DIR = Path(__file__).resolve().parent
+BACKEND_ROOT = CURRENT_DIR.parent
+if str(BACKEND_ROOT) not in sys.path:
+    sys.path.append(str(BACKEND_ROOT))
+
+from app.utils.embeddings import prepare_text_for_embedding  # noqa: E402
+
+
+# COPYでステージングに送る1チャンクあたりのレコード数
+DEFAULT_CHUNK_SIZE = 5000
+# JSON配列を読み込む際のバッファサイズ
+READ_BUFFER_SIZE = 1 << 16
+
+STAGING_COLUMNS = [
+    "seq",
+    "name",
+    "manufacturer",
+    "series",
+    "ceiling_height_min",
+    "ceiling_height_max",
+    "suitable_for",
+    "description",
+    "embedding_text",
+]
+
+
+def load_database_url() -> str:
+    """環境変数からDATABASE_URLを取得する"""
+    load_dotenv(dotenv_path=BACKEND_ROOT / ".env")
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        raise ValueError("DATABASE_URL が設定されていません")
+
+    # SQLAlchemy向けにschemaクエリパラメータを除去
+    if "?schema=" in database_url:
+        database_url = database_url.split("?")[0]
+
+    return database_url
+
+
+def iter_json_array(path: Path) -> Iterator[Dict[str, Any]]:
+    """JSON配列のファイルを全体を読み込まずに要素ごとに返す"""
+    decoder = json.JSONDecoder()
+    with path.open("r", encoding="utf-8") as f:
+        buffer = ""
+        started = False
+        eof = False
+        while True:
+            buffer = buffer.lstrip()
+            if not started:
+                if not buffer.startswith("[") and not eof:
+                    chunk = f.read(READ_BUFFER_SIZE)
+                    if chunk:
+                        buffer += chunk
+                        continue
+                if not buffer.startswith("["):
+                    raise ValueError(f"JSON配列ではありません: {path}")
+                buffer = buffer[1:]
+                started = True
+                continue
+
+            if buffer.startswith(","):
+                buffer = buffer[1:]
+                continue
+            if buffer.startswith("]"):
+                return
+
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                # 要素が途中で切れているので続きを読み込む
+                if eof:
+                    raise
+                chunk = f.read(READ_BUFFER_SIZE)
+                if not chunk:
+                    eof = True
+                buffer += chunk
+                continue
+
+            # 数値などはバッファ末尾で途切れている可能性があるため、区切りが見えるまで読む
+            if end == len(buffer) and not eof:
+                chunk = f.read(READ_BUFFER_SIZE)
+                if chunk:
+                    buffer += chunk
+                    continue
+                eof = True
+
+            yield item
+            buffer = buffer[end:]
+
+
+def iter_jsonl(path: Path) -> Iterator[Dict[str, Any]]:
+    """JSONLファイルを1行ずつ返す"""
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def _parse_suitable_for(value: str) -> List[str]:
+    """CSVの用途列をリストに変換（JSON配列または「;」区切り）"""
+    value = (value or "").strip()
+    if not value:
+        return []
+    if value.startswith("["):
+        return json.loads(value)
+    return [part.strip() for part in value.split(";") if part.strip()]
+
+
+def iter_csv(path: Path) -> Iterator[Dict[str, Any]]:
+    """CSVファイル（ヘッダー付き）を1行ずつ返す"""
+    with path.open("r", encoding="utf-8-sig", newline="") as f:
+        for row in csv.DictReader(f):
+            row["suitable_for"] = _parse_suitable_for(row.get("suitable_for", ""))
+            yield row
+
+
+def iter_records(path: Path, file_format: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """拡張子（または指定形式）に応じたリーダーでレコードを返す"""
+    file_format = file_format or path.suffix.lstrip(".").lower()
+    if file_format == "json":
+        return iter_json_array(path)
+    if file_format in ("jsonl", "ndjson"):
+        return iter_jsonl(path)
+    if file_format == "csv":
+        return iter_csv(path)
+    raise ValueError(f"未対応のファイル形式です: {file_format}")
+
+
+def to_staging_row(seq: int, record: Dict[str, Any]) -> List[Any]:
+    """レコードをステージングテーブルの1行に変換（embedding用テキストも同時に計算）"""
+    name = (record.get("name") or "").strip()
+    manufacturer = (record.get("manufacturer") or "").strip()
+    if not name or not manufacturer:
+        raise ValueError(f"{seq}件目: name と manufacturer は必須です")
+
+    suitable_for = record.get("suitable_for") or []
+    description = record.get("description") or None
+
+    return [
+        seq,
+        name,
+        manufacturer,
+        (record.get("series") or name).strip(),
+        float(record.get("ceiling_height_min") or 0),
+        float(record.get("ceiling_height_max") or 0),
+        json.dumps(suitable_for, ensure_ascii=False),
+        description,
+        prepare_text_for_embedding(description or "", suitable_for),
+    ]
+
+
+def chunked(rows: Iterable[List[Any]], size: int) -> Iterator[List[List[Any]]]:
+    """イテレータを指定サイズのリストに分割"""
+    iterator = iter(rows)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def copy_to_staging(cursor, rows: List[List[Any]]) -> None:
+    """1チャンク分をCOPYでステージングテーブルに書き込む"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(["" if value is None else value for value in row])
+    buffer.seek(0)
+    cursor.copy_expert(
+        f"COPY product_categories_staging ({', '.join(STAGING_COLUMNS)}) "
+        "FROM STDIN WITH (FORMAT csv)",
+        buffer,
+    )
+
+
+CREATE_STAGING_SQL = """
+    CREATE TEMP TABLE product_categories_staging (
+        seq BIGINT NOT NULL,
+        name VARCHAR(255) NOT NULL,
+        manufacturer VARCHAR(100) NOT NULL,
+        series VARCHAR(100) NOT NULL,
+        ceiling_height_min DOUBLE PRECISION NOT NULL,
+        ceiling_height_max DOUBLE PRECISION NOT NULL,
+        suitable_for JSONB NOT NULL,
+        description TEXT,
+        embedding_text TEXT
+    ) ON COMMIT DROP
+"""
+
+# 同じ自然キーが複数回現れた場合は後のレコードを優先する。
+# 内容が変わらない行は更新せず、embedding_textが変わった行だけembeddingを破棄する。
+UPSERT_SQL = """
+    WITH upserted AS (
+        INSERT INTO product_categories (
+            name, manufacturer, series, ceiling_height_min, ceiling_height_max,
+            suitable_for, description, embedding_text
+        )
+        SELECT DISTINCT ON (manufacturer, name)
+            name, manufacturer, series, ceiling_height_min, ceiling_height_max,
+            suitable_for, description, embedding_text
+        FROM product_categories_staging
+        ORDER BY manufacturer, name, seq DESC
+        ON CONFLICT (manufacturer, name) DO UPDATE SET
+            series = EXCLUDED.series,
+            ceiling_height_min = EXCLUDED.ceiling_height_min,
+            ceiling_height_max = EXCLUDED.ceiling_height_max,
+            suitable_for = EXCLUDED.suitable_for,
+            description = EXCLUDED.description,
+            embedding_text = EXCLUDED.embedding_text,
+            embedding = CASE
+                WHEN product_categories.embedding_text IS DISTINCT FROM EXCLUDED.embedding_text
+                THEN NULL
+                ELSE product_categories.embedding
+            END
+        WHERE (
+            product_categories.series,
+            product_categories.ceiling_height_min,
+            product_categories.ceiling_height_max,
+            product_categories.suitable_for,
+            product_categories.description,
+            product_categories.embedding_text
+        ) IS DISTINCT FROM (
+            EXCLUDED.series,
+            EXCLUDED.ceiling_height_min,
+            EXCLUDED.ceiling_height_max,
+            EXCLUDED.suitable_for,
+            EXCLUDED.description,
+            EXCLUDED.embedding_text
+        )
+        RETURNING (xmax = 0) AS inserted
+    )
+    SELECT
+        COUNT(*) FILTER (WHERE inserted),
+        COUNT(*) FILTER (WHERE NOT inserted)
+    FROM upserted
+"""
+
+DELETE_MISSING_SQL = """
+    DELETE FROM product_categories AS p
+    WHERE NOT EXISTS (
+        SELECT 1 FROM product_categories_staging AS s
+        WHERE s.manufacturer = p.manufacturer AND s.name = p.name
+    )
+"""
+
+
+def backfill_embedding_text(conn, cursor, batch_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    """
+    embedding_text が未設定の既存行（シードなどで投入された行）に、embedding生成時と同じテキストを設定する
+
+    未設定のままupsertすると全行でembedding_textが変わったと判定され、embeddingが破棄されてしまう。
+    全件をメモリに載せないよう、名前付き（サーバーサイド）カーソルで batch_size 件ずつ読み込んで更新する
+
+    Args:
+        conn: 取り込み中のトランザクションのDB接続
+        cursor: 更新に使うカーソル
+        batch_size: 1回に読み込んで更新する行数
+
+    Returns:
+        設定した行数
+    """
+    total = 0
+    reader = conn.cursor(name="backfill_embedding_text")
+    reader.itersize = batch_size
+    try:
+        reader.execute("SELECT id, description, suitable_for FROM product_categories WHERE embedding_text IS NULL")
+        while True:
+            rows = reader.fetchmany(batch_size)
+            if not rows:
+                break
+            updates = []
+            for category_id, description, suitable_for in rows:
+                if isinstance(suitable_for, str):
+                    suitable_for = json.loads(suitable_for)
+                updates.append((prepare_text_for_embedding(description or "", suitable_for or []), category_id))
+            execute_batch(cursor, "UPDATE product_categories SET embedding_text = %s WHERE id = %s", updates)
+            total += len(updates)
+    finally:
+        reader.close()
+    return total
+
+
+def ingest(
+    path: Path,
+    file_format: Optional[str] = None,
+    replace: bool = False,
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> Dict[str, int]:
+    """
+    カタログファイルを product_categories に取り込む
+
+    Args:
+        path: 入力ファイル（.json / .jsonl / .csv）
+        file_format: ファイル形式（省略時は拡張子から判定）
+        replace: 入力に含まれない既存行を削除するか
+        chunk_size: COPY 1回あたりのレコード数
+
+    Returns:
+        件数の集計（staged, inserted, updated, deleted）
+    """
+    engine = create_engine(load_database_url())
+    rows = (to_staging_row(seq, record) for seq, record in enumerate(iter_records(path, file_format)))
+
+    stats = {"staged": 0, "inserted": 0, "updated": 0, "deleted": 0}
+    raw_conn = engine.raw_connection()
+    try:
+        cursor = raw_conn.cursor()
+        cursor.execute(CREATE_STAGING_SQL)
+
+        for chunk in chunked(rows, chunk_size):
+            copy_to_staging(cursor, chunk)
+            stats["staged"] += len(chunk)
+            print(f"[INFO] {stats['staged']}件をステージングに投入しました")
+
+        if stats["staged"] == 0:
+            raise ValueError("取り込むレコードがありません")
+
+        backfilled = backfill_embedding_text(raw_conn, cursor, batch_size=chunk_size)
+        if backfilled:
+            print(f"[INFO] 既存の{backfilled}件に embedding_text を設定しました")
+
+        cursor.execute("ANALYZE product_categories_staging")
+        cursor.execute(UPSERT_SQL)
+        stats["inserted"], stats["updated"] = cursor.fetchone()
+
+        if replace:
+            cursor.execute(DELETE_MISSING_SQL)
+            stats["deleted"] = cursor.rowcount
+
+        # ここまでを1トランザクションで反映する
+        raw_conn.commit()
+    except Exception:
+        raw_conn.rollback()
+        raise
+    finally:
+        raw_conn.close()
+        engine.dispose()
+
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="製品カテゴリのカタログをストリーミング投入します")
+    parser.add_argument("path", type=Path, help="入力ファイル（.json / .jsonl / .csv）")
+    parser.add_argument("--format", choices=["json", "jsonl", "csv"], help="ファイル形式（省略時は拡張子から判定）")
+    parser.add_argument("--replace", action="store_true", help="入力に含まれない既存行を削除する")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="COPY 1回あたりのレコード数")
+    args = parser.parse_args()
+
+    stats = ingest(args.path, file_format=args.format, replace=args.replace, chunk_size=args.chunk_size)
+    print(
+        f"[DONE] 投入 {stats['staged']}件 / 追加 {stats['inserted']}件 / "
+        f"更新 {stats['updated']}件 / 削除 {stats['deleted']}件"
+    )
+    print("[INFO] embeddingが未生成の行は scripts/generate_embeddings.py --only-missing で生成してください")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""よく使われる条件の組み合わせについて推薦候補を事前計算するスクリプト
+
+カタログの suitable_for の語彙（部屋種別）× 天井高の区分 × 特殊環境フラグの組み合わせごとに、
+エージェントと同じ検索（Embedding検索 + LLM再ランキング）を1回だけ実行し、
+順位付きの候補IDを precomputed_recommendations テーブルに保存する。
+
+使い方:
+    python scripts/precompute_recommendations.py
+    # カタログが前回の計算以降に変更された場合のみ再計算
+    python scripts/precompute_recommendations.py --if-stale
+    # カタログの変更を監視して自動で再計算
+    python scripts/precompute_recommendations.py --watch
+"""
+
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+
+# backendディレクトリをPythonパスに追加
+CURRENT_DIR = Path(__file__).resolve().parent
+BACKEND_ROOT = CURRENT_DIR.parent
+if str(BACKEND_ROOT) not in sys.path:
+    sys.path.append(str(BACKEND_ROOT))
+
+load_dotenv(dotenv_path=BACKEND_ROOT / ".env")
+
+from app.agents.lighting_agent import LightingAgent, build_search_terms  # noqa: E402
+from app.models.chat import ProjectInfo  # noqa: E402
+from app.utils.catalog_changes import get_catalog_change_feed  # noqa: E402
+from app.utils.recommendations import (  # noqa: E402
+    CEILING_BANDS,
+    fetch_catalog_version,
+    fetch_room_vocabulary,
+    save_recommendations,
+)
+from app.utils.search_categories import engine  # noqa: E402
+
+
+if sys.platform.startswith("win"):
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+
+# 天井高の区分ごとの代表値（build_search_terms に渡す）
+CEILING_BAND_HEIGHTS: Dict[str, Optional[float]] = {"none": None, "low": 3.0, "high": 10.0}
+# 保存する候補数（応答に含める最大件数と同じ）
+MAX_CANDIDATES = 10
+# 変更を検知してから再計算を始めるまでの待ち時間（秒、連続した更新をまとめる）
+WATCH_SETTLE_SECONDS = 10
+
+
+def fetch_stored_version() -> int:
+    """保存済みの推薦テーブルの基になったカタログ変更version（未計算なら-1）"""
+    with engine.connect() as conn:
+        result = conn.execute(text("SELECT MIN(catalog_version) FROM precomputed_recommendations"))
+        value = result.scalar()
+    return -1 if value is None else int(value)
+
+
+async def compute_recommendation(
+    agent: LightingAgent,
+    room_type: str,
+    band: str,
+    special_environment: bool,
+    semaphore: asyncio.Semaphore
+) -> Dict[str, Any]:
+    """1つの組み合わせについて検索と再ランキングを実行する"""
+    project_info = ProjectInfo(
+        room_name=room_type,
+        ceiling_height=CEILING_BAND_HEIGHTS[band],
+        special_environment=special_environment,
+    )
+    query, keywords = build_search_terms(project_info, "")
+    async with semaphore:
+        candidates = await agent.retrieve_candidates(query, keywords)
+
+    return {
+        "room_type": room_type,
+        "ceiling_band": band,
+        "special_environment": special_environment,
+        "query": query,
+        "candidate_ids": [candidate["id"] for candidate in candidates[:MAX_CANDIDATES]],
+    }
+
+
+async def precompute(concurrency: int, extra_rooms: List[str]) -> int:
+    """
+    全ての組み合わせを計算して推薦テーブルを置き換える
+
+    Returns:
+        保存した組み合わせの件数
+    """
+    # 計算前のversionを記録し、計算中の変更は次回の再計算で取り込む
+    catalog_version = fetch_catalog_version(engine)
+    room_types = sorted(set(fetch_room_vocabulary(engine)) | set(extra_rooms))
+    print(f"[INFO] 部屋種別 {len(room_types)}件 × 天井高 {len(CEILING_BANDS)}区分 × 特殊環境 2通りを計算します")
+
+    agent = LightingAgent()
+    semaphore = asyncio.Semaphore(concurrency)
+    results = await asyncio.gather(*[
+        compute_recommendation(agent, room_type, band, special_environment, semaphore)
+        for room_type in room_types
+        for band in CEILING_BANDS
+        for special_environment in (False, True)
+    ])
+
+    rows = [row for row in results if row["candidate_ids"]]
+    save_recommendations(engine, rows, catalog_version)
+    print(f"[DONE] {len(rows)}件の組み合わせを保存しました（catalog version {catalog_version}）")
+    return len(rows)
+
+
+async def watch(concurrency: int, extra_rooms: List[str]) -> None:
+    """カタログの変更を監視し、変更があれば再計算する"""
+    changed = asyncio.Event()
+    # カテゴリキャッシュと同じフィードを使い、変更のあった行をキャッシュからも破棄させる
+    feed = get_catalog_change_feed()
+    feed.subscribe(lambda change: changed.set())
+    await feed.start()
+
+    if fetch_stored_version() < feed.version:
+        changed.set()
+
+    print("[INFO] カタログの変更を監視しています")
+    try:
+        while True:
+            await changed.wait()
+            await asyncio.sleep(WATCH_SETTLE_SECONDS)
+            changed.clear()
+            await precompute(concurrency, extra_rooms)
+    finally:
+        await feed.stop()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="推薦候補を事前計算します")
+    parser.add_argument("--if-stale", action="store_true", help="カタログが変更されている場合のみ再計算する")
+    parser.add_argument("--watch", action="store_true", help="カタログの変更を監視して自動で再計算する")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時に実行する検索数")
+    parser.add_argument("--room", action="append", default=[], help="語彙に追加する部屋種別（複数指定可）")
+    args = parser.parse_args()
+
+    if args.watch:
+        await watch(args.concurrency, args.room)
+        return
+
+    if args.if_stale and fetch_stored_version() >= fetch_catalog_version(engine):
+        print("[INFO] 推薦テーブルは最新です")
+        return
+
+    await precompute(args.concurrency, args.room)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
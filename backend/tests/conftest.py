@@ -0,0 +1,9 @@
+"""テスト共通設定"""
+import sys
+from pathlib import Path
+
+
+# backendディレクトリをPythonパスに追加
+BACKEND_ROOT = Path(__file__).resolve().parent.parent
+if str(BACKEND_ROOT) not in sys.path:
+    sys.path.insert(0, str(BACKEND_ROOT))
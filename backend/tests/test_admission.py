@@ -0,0 +1,97 @@
+"""アドミッション制御（枠の引き渡し・タイムアウト・キャンセル）のテスト"""
+import asyncio
+
+import pytest
+
+from app.utils.admission import AdmissionController, AdmissionRejected
+
+
+async def _hold(controller: AdmissionController, entered: asyncio.Event, release: asyncio.Event) -> None:
+    async with controller.admit():
+        entered.set()
+        await release.wait()
+
+
+def test_slot_is_handed_to_waiter():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=1, max_queue=4, queue_timeout=5)
+        entered, release = asyncio.Event(), asyncio.Event()
+        holder = asyncio.create_task(_hold(controller, entered, release))
+        await entered.wait()
+
+        waiter_entered, waiter_release = asyncio.Event(), asyncio.Event()
+        waiter = asyncio.create_task(_hold(controller, waiter_entered, waiter_release))
+        await asyncio.sleep(0)
+        assert controller.queue_depth == 1
+
+        release.set()
+        await waiter_entered.wait()
+        # 枠は引き渡されるため、実行中の数は増えない
+        assert controller.in_flight == 1
+
+        waiter_release.set()
+        await asyncio.gather(holder, waiter)
+        assert controller.in_flight == 0
+        assert controller.queue_depth == 0
+
+    asyncio.run(scenario())
+
+
+def test_waiter_times_out_without_leaking_slot():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=1, max_queue=4, queue_timeout=0.01)
+        entered, release = asyncio.Event(), asyncio.Event()
+        holder = asyncio.create_task(_hold(controller, entered, release))
+        await entered.wait()
+
+        with pytest.raises(AdmissionRejected):
+            async with controller.admit():
+                pass
+        assert controller.rejected_timeout == 1
+        assert controller.queue_depth == 0
+
+        release.set()
+        await holder
+        assert controller.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_does_not_leak_slot():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=1, max_queue=4, queue_timeout=5)
+        entered, release = asyncio.Event(), asyncio.Event()
+        holder = asyncio.create_task(_hold(controller, entered, release))
+        await entered.wait()
+
+        waiter = asyncio.create_task(_hold(controller, asyncio.Event(), asyncio.Event()))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert controller.queue_depth == 0
+
+        release.set()
+        await holder
+        assert controller.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_slot_handed_over_in_same_tick_as_timeout_is_used(monkeypatch):
+    async def scenario():
+        controller = AdmissionController(max_concurrency=1, max_queue=4, queue_timeout=5)
+        await controller._acquire()
+
+        async def release_then_time_out(waiter):
+            # 枠の引き渡しとタイムアウトが同じタイミングで起きた状況を再現する
+            controller._release()
+            raise asyncio.TimeoutError
+
+        monkeypatch.setattr(controller, "_wait", release_then_time_out)
+        async with controller.admit():
+            assert controller.in_flight == 1
+        assert controller.in_flight == 0
+        assert controller.rejected_timeout == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,77 @@
+"""カタログ変更フィードの正常判定（healthy）のテスト"""
+import asyncio
+
+from app.utils import catalog_changes
+from app.utils.catalog_changes import CatalogChange, CatalogChangeFeed
+
+
+def _feed(monkeypatch, fail: bool) -> CatalogChangeFeed:
+    feed = CatalogChangeFeed(engine=None, poll_interval=60)
+    state = {"fail": fail}
+
+    def initialize():
+        if state["fail"]:
+            raise RuntimeError("relation \"product_category_changes\" does not exist")
+
+    def fetch_changes():
+        initialize()
+        return None
+
+    monkeypatch.setattr(feed, "initialize", initialize)
+    monkeypatch.setattr(feed, "fetch_changes", fetch_changes)
+    feed.state = state
+    return feed
+
+
+def test_feed_is_not_healthy_until_a_poll_succeeds(monkeypatch):
+    async def scenario():
+        feed = _feed(monkeypatch, fail=True)
+        await feed.start()
+        assert feed.running
+        assert not feed.healthy
+
+        feed.state["fail"] = False
+        await feed.poll_once()
+        assert feed.healthy
+
+        await feed.stop()
+        assert not feed.healthy
+
+    asyncio.run(scenario())
+
+
+def test_feed_becomes_unhealthy_when_polls_keep_failing(monkeypatch):
+    async def scenario():
+        feed = _feed(monkeypatch, fail=False)
+        await feed.start()
+        assert feed.healthy
+
+        # 最後の成功からポーリング間隔 x CATALOG_FEED_HEALTHY_POLLS を過ぎた状況を再現する
+        now = catalog_changes.time.monotonic()
+        monkeypatch.setattr(
+            catalog_changes.time,
+            "monotonic",
+            lambda: now + feed.poll_interval * catalog_changes.CATALOG_FEED_HEALTHY_POLLS + 1
+        )
+        assert feed.running
+        assert not feed.healthy
+        await feed.stop()
+
+    asyncio.run(scenario())
+
+
+def test_feed_is_healthy_only_after_changes_are_delivered(monkeypatch):
+    async def scenario():
+        feed = _feed(monkeypatch, fail=True)
+        await feed.start()
+        seen = []
+        feed.subscribe(lambda change: seen.append(feed.healthy))
+        monkeypatch.setattr(feed, "fetch_changes", lambda: CatalogChange(version=1, updated_ids={1}))
+
+        await feed.poll_once()
+        # 通知中はまだ正常とみなさない（復旧直後に未通知の変更がある状態で使われないように）
+        assert seen == [False]
+        assert feed.healthy
+        await feed.stop()
+
+    asyncio.run(scenario())
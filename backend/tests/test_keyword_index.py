@@ -0,0 +1,130 @@
+"""キーワード検索の転置インデックス（部分一致・BM25の順位・差分反映・詰め直し）のテスト"""
+import asyncio
+
+from app.utils.keyword_index import KeywordIndex
+
+
+class _Feed:
+    """テスト用の変更フィード（購読を記録するだけ）"""
+
+    running = True
+    healthy = True
+    generation = 0
+
+    def subscribe(self, callback) -> None:
+        pass
+
+
+def _category(category_id: int, name: str, description: str = "", suitable_for=None):
+    return {
+        "id": category_id,
+        "name": name,
+        "description": description,
+        "suitable_for": suitable_for or [],
+        "manufacturer": "A",
+    }
+
+
+def _ids(results):
+    return [category["id"] for category in results]
+
+
+def _build(categories):
+    index = KeywordIndex(_Feed())
+    index.build(categories)
+    return index
+
+
+def test_search_requires_contiguous_match():
+    index = _build([
+        _category(1, "高天井用ベースライト"),
+        # 「高天」「天井」は含むが「高天井」は含まない
+        _category(2, "高天 天井直付"),
+        _category(3, "ダウンライト"),
+    ])
+    assert _ids(index.search(["高天井"])) == [1]
+    assert sorted(_ids(index.search(["天井"]))) == [1, 2]
+    assert index.search(["防爆"]) == []
+
+
+def test_search_ranks_by_bm25_and_id():
+    index = _build([
+        _category(1, "ダウンライト", "会議室向け"),
+        _category(2, "ダウンライト", "会議室 会議室 会議室"),
+        _category(3, "ダウンライト", "会議室向け"),
+    ])
+    # 出現回数の多い文書が先、同点はIDの順
+    assert _ids(index.search(["会議室"])) == [2, 1, 3]
+    assert _ids(index.search(["会議室"], limit=2)) == [2, 1]
+    assert index.search(["会議室"], limit=0) == []
+
+
+def test_scores_are_summed_across_keywords():
+    index = _build([
+        _category(1, "ダウンライト"),
+        _category(2, "防湿ダウンライト"),
+        _category(3, "防湿ブラケット"),
+    ])
+    assert _ids(index.search(["防湿", "ダウンライト"]))[0] == 2
+    assert sorted(_ids(index.search(["防湿", "ダウンライト"]))) == [1, 2, 3]
+
+
+def test_separator_only_keyword_matches_nothing():
+    index = _build([
+        _category(1, "ダウンライト・ベースライト"),
+        _category(2, "防雨(屋外)"),
+    ])
+    for keyword in ("・・", "、、", "()"):
+        assert index.search([keyword]) == []
+    # 区切り文字だけのキーワードが混ざっていても他のキーワードで検索できる
+    assert _ids(index.search(["・・", "防雨"])) == [2]
+
+
+def test_single_character_keyword():
+    index = _build([
+        _category(1, "LED 丸形"),
+        _category(2, "角形"),
+    ])
+    assert _ids(index.search(["丸"])) == [1]
+
+
+def test_update_replaces_changed_rows():
+    index = _build([
+        _category(1, "防雨スポットライト"),
+        _category(2, "ダウンライト"),
+    ])
+    index.update([_category(2, "防雨ダウンライト")], [1])
+    assert _ids(index.search(["防雨"])) == [2]
+    assert index.size == 1
+
+
+def test_compaction_swaps_in_rebuilt_index():
+    async def scenario():
+        index = _build([_category(i, f"ダウンライト{i}") for i in range(1, 5)])
+        index.update([], [1, 2])
+        before = index._data
+        await index._compact()
+        assert index._data is not before
+        assert index._data.dead == 0
+        assert _ids(index.search(["ダウンライト"])) == [3, 4]
+
+    asyncio.run(scenario())
+
+
+def test_compaction_is_dropped_when_rows_change_meanwhile(monkeypatch):
+    async def scenario():
+        index = _build([_category(i, f"ダウンライト{i}") for i in range(1, 5)])
+        index.update([], [1])
+        before = index._data
+
+        async def update_during_build(func, *args):
+            # 詰め直しの構築中に差分が反映された状況を再現する
+            index.update([_category(5, "ダウンライト5")], [])
+            return func(*args)
+
+        monkeypatch.setattr("app.utils.keyword_index.asyncio.to_thread", update_during_build)
+        await index._compact()
+        assert index._data is before
+        assert 5 in _ids(index.search(["ダウンライト"]))
+
+    asyncio.run(scenario())